@@ -1,4 +1,8 @@
-from flask import Flask
+import os
+
+from flask import Flask, send_file
+
+STATS_FILE = "stats.json"
 
 app = Flask(__name__)
 
@@ -8,5 +12,13 @@ def hello_world():
     return "This is Moon"
 
 
+@app.route("/stats")
+def stats():
+    # Handler stats, dumped by the userbot process every 30 seconds
+    if not os.path.exists(STATS_FILE):
+        return {"error": "no stats yet"}, 404
+    return send_file(os.path.abspath(STATS_FILE), mimetype="application/json")
+
+
 if __name__ == "__main__":
     app.run()
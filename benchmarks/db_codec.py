@@ -0,0 +1,130 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Decode cost per read of SqliteDatabase values, JSON text vs pickle BLOB.
+Before timing, every type PickleCodec may store is checked to round-trip.
+
+Run it from the repository root as a module (running the file directly
+can't import utils):
+
+    python -m benchmarks.db_codec [entries] [reads]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# utils.db reads the config and opens the configured database on import,
+# point both at throwaway values so the real database is never touched
+_tmp = tempfile.TemporaryDirectory()
+os.environ.update(
+    API_ID="1",
+    API_HASH="0" * 32,
+    APIFLASH_KEY="",
+    DATABASE_TYPE="sqlite",
+    DATABASE_NAME=os.path.join(_tmp.name, "import.db"),
+)
+
+from utils.db import (  # noqa: E402
+    _PICKLE_TYPES,
+    JsonCodec,
+    PickleCodec,
+    SqliteDatabase,
+)
+
+# One value of every type PickleCodec may store
+ROUND_TRIP = {
+    bool: True,
+    int: 2**70,
+    float: 0.5,
+    complex: 1 + 2j,
+    str: "text",
+    bytes: b"\x00\xff",
+    list: [1, "two", [3.0]],
+    tuple: (1, (2j, b"x")),
+    dict: {1: "int key", ("a", "b"): {"nested": None}},
+    set: {1, "two"},
+    frozenset: frozenset({(1, 2)}),
+}
+
+
+def sample_value(entries: int) -> dict:
+    """A filters map like the one modules/filters.py keeps per chat"""
+    return {
+        f"trigger {i}": {
+            "type": "text" if i % 3 else "photo",
+            "content": f"reply number {i} " * 4,
+            "media": None if i % 3 else f"AgACAgIAAxkBAAI{i:08d}",
+        }
+        for i in range(entries)
+    }
+
+
+def check_round_trip():
+    """Every stored type must come back equal and of the same type"""
+    missing = set(_PICKLE_TYPES.values()) - set(ROUND_TRIP)
+    assert not missing, f"no round trip value for {missing}"
+    with tempfile.TemporaryDirectory() as tmp:
+        database = SqliteDatabase(os.path.join(tmp, "check.db"))
+        for typ, value in ROUND_TRIP.items():
+            database.set("core.check", typ.__name__, value)
+            for result in (
+                PickleCodec.loads(PickleCodec.dumps(value)),
+                database.get("core.check", typ.__name__),
+            ):
+                assert type(result) is typ and result == value, (value, result)
+        database.close()
+
+
+def bench_decode(codec, value, reads: int) -> float:
+    data = codec.dumps(value)
+    start = time.perf_counter()
+    for _ in range(reads):
+        codec.loads(data)
+    return (time.perf_counter() - start) / reads
+
+
+def bench_get(codec, value, reads: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        database = SqliteDatabase(os.path.join(tmp, "bench.db"), codec=codec)
+        database.set("core.filters", "-100123", value)
+        start = time.perf_counter()
+        for _ in range(reads):
+            database.get("core.filters", "-100123")
+        elapsed = (time.perf_counter() - start) / reads
+        database.close()
+    return elapsed
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    reads = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    value = sample_value(entries)
+    check_round_trip()
+
+    print(f"{entries} entries, {reads} reads")
+    print(f"{'codec':<8}{'size, B':>10}{'decode, us':>14}{'get(), us':>14}")
+    for codec in (JsonCodec, PickleCodec):
+        size = len(codec.dumps(value))
+        decode = bench_decode(codec, value, reads) * 1e6
+        get = bench_get(codec, value, reads) * 1e6
+        print(f"{codec.name:<8}{size:>10}{decode:>14.1f}{get:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Boot time of main.py, offline: stub client, temp sqlite database.
+
+Every run boots a fresh interpreter with --profile-startup, where
+Client.start()/stop() don't connect and idle() returns at once. Medians of
+the runs are printed, and saved with --save. With --baseline (a file saved
+before) it exits with 1 if the total got slower by more than --tolerance.
+
+Usage: python -m benchmarks.startup [runs] [--save path] [--baseline path]
+"""
+
+import argparse
+import json
+import os
+import runpy
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def boot(report_path: str):
+    """Run main.py in this interpreter with the network parts stubbed"""
+    # Before pyrogram and the rest, so their imports are timed too
+    sys.path.insert(0, ROOT)
+    from utils.profiler import profiler
+
+    profiler.start()
+
+    import pyrogram
+    from pyrogram import types
+
+    async def start(self, *args, **kwargs):
+        self.me = types.User(id=1, is_self=True, first_name="bench")
+        return self
+
+    async def stop(self, *args, **kwargs):
+        return self
+
+    async def idle():
+        pass
+
+    pyrogram.Client.start = start
+    pyrogram.Client.stop = stop
+    pyrogram.idle = idle
+
+    sys.argv = ["main.py", f"--profile-startup={report_path}"]
+    runpy.run_path(os.path.join(ROOT, "main.py"), run_name="__main__")
+
+
+def run_once(tmp: str, index: int) -> dict:
+    report_path = os.path.join(tmp, f"profile-{index}.json")
+    env = dict(
+        os.environ,
+        API_ID="1",
+        API_HASH="0" * 32,
+        APIFLASH_KEY="",
+        DATABASE_TYPE="sqlite",
+        DATABASE_NAME=os.path.join(tmp, f"bench-{index}.db"),
+        STRINGSESSION="",
+    )
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--boot", report_path],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0 or not os.path.exists(report_path):
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f"run {index} failed with code {proc.returncode}")
+    with open(report_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def median_report(reports: list) -> dict:
+    def median(values) -> float:
+        return round(statistics.median(values), 6)
+
+    def merged(key: str) -> dict:
+        names = {name for report in reports for name in report["imports"][key]}
+        result = {
+            name: median(report["imports"][key].get(name, 0.0) for report in reports)
+            for name in names
+        }
+        return dict(sorted(result.items(), key=lambda item: -item[1]))
+
+    phases = {name for report in reports for name in report["phases"]}
+    return {
+        "runs": len(reports),
+        "total": median(report["total"] for report in reports),
+        "phases": {
+            name: median(
+                report["phases"].get(name, {"seconds": 0.0})["seconds"]
+                for report in reports
+            )
+            for name in sorted(phases)
+        },
+        "imports": {
+            "modules": merged("modules"),
+            "dependencies": merged("dependencies"),
+            "own": median(report["imports"]["own"] for report in reports),
+            "stdlib": median(report["imports"]["stdlib"] for report in reports),
+        },
+    }
+
+
+def print_report(result: dict, top: int = 10):
+    print(f"{result['runs']} runs, median total {result['total'] * 1000:.0f} ms")
+    print(f"{'phase':<32}{'ms':>10}")
+    for name, seconds in result["phases"].items():
+        print(f"{name:<32}{seconds * 1000:>10.1f}")
+    for key in ("dependencies", "modules"):
+        print(f"{'slowest ' + key:<32}{'ms':>10}")
+        for name, seconds in list(result["imports"][key].items())[:top]:
+            print(f"{name:<32}{seconds * 1000:>10.1f}")
+
+
+def main():
+    if sys.argv[1:2] == ["--boot"]:
+        boot(sys.argv[2])
+        return
+
+    parser = argparse.ArgumentParser(description="Offline boot benchmark")
+    parser.add_argument("runs", type=int, nargs="?", default=5)
+    parser.add_argument("--save", help="write the medians to this file")
+    parser.add_argument("--baseline", help="medians saved by an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        reports = [run_once(tmp, index) for index in range(args.runs)]
+    result = median_report(reports)
+    print_report(result)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        limit = baseline["total"] * (1 + args.tolerance)
+        if result["total"] > limit:
+            print(
+                f"Startup regressed: {result['total'] * 1000:.0f} ms "
+                f"> {limit * 1000:.0f} ms ({baseline['total'] * 1000:.0f} ms baseline)"
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
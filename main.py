@@ -42,13 +42,32 @@
 #     "lexica-api",
 # ]
 # ///
+import sys
+
+from utils.profiler import PROFILE_FILE, profiler
+
+# --profile-startup[=path], started before the imports it should time
+PROFILE_STARTUP = next(
+    (
+        arg.partition("=")[2] or PROFILE_FILE
+        for arg in sys.argv[1:]
+        if arg.partition("=")[0] == "--profile-startup"
+    ),
+    None,
+)
+if PROFILE_STARTUP:
+    profiler.start()
+
+import asyncio
 import os
 import logging
 
 import sqlite3
 import platform
 import subprocess
+import time
 from pathlib import Path
+from typing import List
 
 from pyrogram import Client, idle, errors
 from pyrogram.enums.parse_mode import ParseMode
@@ -57,20 +76,34 @@ import requests
 
 from utils import config
 from utils.db import db
-from utils.misc import gitrepo, userbot_version
-from utils.scripts import restart, load_module
+from utils.manifest import load as load_manifests
+from utils.metrics import dump_loop
+from utils.misc import fetch_gitrepo, gitrepo, userbot_version
+from utils.scripts import (
+    import_times,
+    lazy_modules,
+    load_module,
+    load_modules,
+    module_path,
+    register_lazy_module,
+    restart,
+)
+from utils.throttle import scheduler
+from utils.watchdog import watchdog
 
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 if SCRIPT_PATH != os.getcwd():
     os.chdir(SCRIPT_PATH)
 
+# Not there yet if the repo is still to be fetched in the background
+head_commit = gitrepo.head.commit.hexsha[:7] if gitrepo.head.is_valid() else "unknown"
 common_params = {
     "api_id": config.api_id,
     "api_hash": config.api_hash,
     "hide_password": True,
     "workdir": SCRIPT_PATH,
     "app_version": userbot_version,
-    "device_model": f"Moon-Userbot @ {gitrepo.head.commit.hexsha[:7]}",
+    "device_model": f"Moon-Userbot @ {head_commit}",
     "system_version": platform.version() + " " + platform.machine(),
     "sleep_threshold": 30,
     "test_mode": config.test_server,
@@ -81,38 +114,75 @@ if config.STRINGSESSION:
     common_params["session_string"] = config.STRINGSESSION
 
 app = Client("my_account", **common_params)
+# Rate limit requests and wait out FloodWaits per method and chat
+scheduler.install(app)
 
 
-def load_missing_modules():
-    all_modules = db.get("custom.modules", "allModules", [])
-    if not all_modules:
-        return
-
+def load_missing_modules(all_modules: List[str]) -> List[str]:
+    """Download custom modules missing on disk, get names of the downloaded ones"""
     custom_modules_path = f"{SCRIPT_PATH}/modules/custom_modules"
     os.makedirs(custom_modules_path, exist_ok=True)
 
+    missing = [
+        module_name
+        for module_name in all_modules
+        if not os.path.exists(f"{custom_modules_path}/{module_name}.py")
+    ]
+    if not missing:
+        return []
+
     try:
         f = requests.get(
-            "https://raw.githubusercontent.com/The-MoonTg-project/custom_modules/main/full.txt"
+            "https://raw.githubusercontent.com/The-MoonTg-project/custom_modules/main/full.txt",
+            timeout=30,
         ).text
     except Exception:
         logging.error("Failed to fetch custom modules list")
-        return
+        return []
     modules_dict = {
         line.split("/")[-1].split()[0]: line.strip() for line in f.splitlines()
     }
 
-    for module_name in all_modules:
-        module_path = f"{custom_modules_path}/{module_name}.py"
-        if not os.path.exists(module_path) and module_name in modules_dict:
-            url = f"https://raw.githubusercontent.com/The-MoonTg-project/custom_modules/main/{modules_dict[module_name]}.py"
-            resp = requests.get(url)
-            if resp.ok:
-                with open(module_path, "wb") as f:
-                    f.write(resp.content)
-                logging.info("Loaded missing module: %s", module_name)
-            else:
-                logging.warning("Failed to load module: %s", module_name)
+    loaded = []
+    for module_name in missing:
+        if module_name not in modules_dict:
+            continue
+        file_path = f"{custom_modules_path}/{module_name}.py"
+        url = f"https://raw.githubusercontent.com/The-MoonTg-project/custom_modules/main/{modules_dict[module_name]}.py"
+        try:
+            resp = requests.get(url, timeout=30)
+        except Exception:
+            logging.warning("Failed to load module: %s", module_name)
+            continue
+        if resp.ok:
+            with open(file_path, "wb") as f:
+                f.write(resp.content)
+            logging.info("Loaded missing module: %s", module_name)
+            loaded.append(module_name)
+        else:
+            logging.warning("Failed to load module: %s", module_name)
+    return loaded
+
+
+async def fetch_in_background():
+    """Network part of the startup, run once the bot already answers"""
+    loop = asyncio.get_running_loop()
+
+    all_modules = db.get("custom.modules", "allModules", [])
+    if all_modules:
+        for module_name in await loop.run_in_executor(
+            None, load_missing_modules, all_modules
+        ):
+            try:
+                await load_module(module_name, app)
+            except Exception:
+                logging.warning("Can't import module %s", module_name, exc_info=True)
+
+    try:
+        if await loop.run_in_executor(None, fetch_gitrepo):
+            logging.info("Fetched Moon-Userbot repo, restart to run its code")
+    except Exception:
+        logging.warning("Can't fetch Moon-Userbot repo", exc_info=True)
 
 
 async def main():
@@ -124,7 +194,8 @@ async def main():
     DeleteAccount.__new__ = None
 
     try:
-        await app.start()
+        with profiler.phase("app.start"):
+            await app.start()
     except sqlite3.OperationalError as e:
         if str(e) == "database is locked" and os.name == "posix":
             logging.warning(
@@ -140,24 +211,52 @@ async def main():
         os.rename("./my_account.session", "./my_account.session-old")
         restart()
 
-    load_missing_modules()
-    success_modules = 0
-    failed_modules = 0
+    # Catch modules blocking the loop from the first update on
+    watchdog.start()
 
-    for path in Path("modules").rglob("*.py"):
-        try:
-            await load_module(
-                path.stem, app, core="custom_modules" not in path.parent.parts
-            )
-        except Exception:
-            logging.warning("Can't import module %s", path.stem, exc_info=True)
-            failed_modules += 1
-        else:
-            success_modules += 1
+    start = time.perf_counter()
+    with profiler.phase("manifests"):
+        manifests = load_manifests(sorted(Path("modules").rglob("*.py")))
+    modules = [
+        (module_name.rsplit(".", 1)[1], "custom_modules" not in module_name)
+        for module_name in manifests
+    ]
+    if config.lazy_modules:
+        # Custom modules stay eager, (re)loading them expects them imported
+        for module_name, core in modules:
+            manifest = manifests[module_path(module_name, core)]
+            if core and manifest["lazy"]:
+                register_lazy_module(module_name, app, manifest)
+        modules = [
+            (module_name, core)
+            for module_name, core in modules
+            if not (core and module_name in lazy_modules)
+        ]
+        logging.info("%s modules will be imported on first use", len(lazy_modules))
+    with profiler.phase("module imports"):
+        failed = await load_modules(
+            app,
+            modules,
+            metas={
+                module_name: manifest["meta"]
+                for module_name, manifest in manifests.items()
+            },
+        )
+    for module_name, error in failed.items():
+        logging.warning("Can't import module %s", module_name, exc_info=error)
 
-    logging.info("Imported %s modules", success_modules)
-    if failed_modules:
-        logging.warning("Failed to import %s modules", failed_modules)
+    logging.info(
+        "Imported %s modules in %.2fs",
+        len(modules) - len(failed),
+        time.perf_counter() - start,
+    )
+    if failed:
+        logging.warning("Failed to import %s modules", len(failed))
+    slowest = sorted(import_times.items(), key=lambda item: -item[1])[:10]
+    logging.info(
+        "Slowest imports: %s",
+        ", ".join(f"{name} {seconds:.2f}s" for name, seconds in slowest),
+    )
 
     if info := db.get("core.updater", "restart_info"):
         text = {
@@ -183,9 +282,23 @@ async def main():
 
     logging.info("Moon-Userbot started!")
 
+    if PROFILE_STARTUP:
+        profiler.stop()
+        profiler.dump(PROFILE_STARTUP)
+        logging.info("Startup profile saved to %s", PROFILE_STARTUP)
+
+    # Handler stats for the /stats page of app.py
+    stats_task = asyncio.create_task(dump_loop())
+    fetch_task = asyncio.create_task(fetch_in_background())
+
     await idle()
 
+    stats_task.cancel()
+    fetch_task.cancel()
+    watchdog.stop()
+
     await app.stop()
+    db.close()
 
 
 if __name__ == "__main__":
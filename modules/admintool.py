@@ -14,6 +14,8 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
+import threading
 from contextlib import suppress
 
 from pyrogram import Client, ContinuePropagation, filters
@@ -25,7 +27,8 @@ from pyrogram.errors import (
 from pyrogram.raw import functions
 from pyrogram.types import Message, ChatPermissions
 
-from utils.db import db
+from utils.db import REMOVED, db
+from utils.prefilter import chat_in
 from utils.scripts import format_exc, with_reply
 from utils.misc import modules_help, prefix
 
@@ -49,13 +52,60 @@ from utils.handlers import (
 
 db_cache: dict = db.get_collection("core.ats")
 
+# Settings that make admintool_handler act on messages of a chat
+CHAT_SETTING = re.compile(r"^(antich|antiraid|welcome_enabled|c)(-?\d+)$")
 
-def update_cache():
-    db_cache.clear()
-    db_cache.update(db.get_collection("core.ats"))
+# Chats with any of those settings on, other chats skip the handler. Database
+# callbacks run on other threads, so the set is replaced, never changed in place
+active_chats = chat_in(frozenset())
+_active_chats_lock = threading.Lock()
 
 
-@Client.on_message(filters.group & ~filters.me)
+def is_active_chat(chat_id: int) -> bool:
+    return any(
+        db_cache.get(f"{setting}{chat_id}")
+        for setting in ("antich", "antiraid", "welcome_enabled", "c")
+    )
+
+
+def update_active_chat(chat_id: int):
+    with _active_chats_lock:
+        if is_active_chat(chat_id):
+            active_chats.chats = active_chats.chats | {chat_id}
+        else:
+            active_chats.chats = active_chats.chats - {chat_id}
+
+
+def update_active_chats():
+    chats = set()
+    for variable in list(db_cache):
+        if (match := CHAT_SETTING.match(variable)) and is_active_chat(int(match[2])):
+            chats.add(int(match[2]))
+    with _active_chats_lock:
+        active_chats.chats = frozenset(chats)
+
+
+def update_cache(variable, value):
+    if variable is None:
+        db_cache.clear()
+        db_cache.update(db.get_collection("core.ats"))
+        update_active_chats()
+        return
+    if value is REMOVED:
+        db_cache.pop(variable, None)
+    else:
+        db_cache[variable] = value
+    if match := CHAT_SETTING.match(variable):
+        update_active_chat(int(match[2]))
+
+
+update_active_chats()
+
+
+db.subscribe("core.ats", update_cache)
+
+
+@Client.on_message(active_chats & filters.group & ~filters.me)
 async def admintool_handler(_, message: Message):
     if message.sender_chat and (
         message.sender_chat.type == "supergroup"
@@ -138,14 +188,12 @@ async def kickdel_cmd(client: Client, message: Message):
 async def tmute_command(client: Client, message: Message):
     handler = TimeMuteHandler(client, message)
     await handler.handle_tmute()
-    update_cache()
 
 
 @Client.on_message(filters.command(["tunmute"], prefix) & filters.me)
 async def tunmute_command(client: Client, message: Message):
     handler = TimeUnmuteHandler(client, message)
     await handler.handle_tunmute()
-    update_cache()
 
 
 @Client.on_message(filters.command(["tmute_users"], prefix) & filters.me)
@@ -182,7 +230,6 @@ async def promote_command(client: Client, message: Message):
 async def anti_channels(client: Client, message: Message):
     handler = AntiChannelsHandler(client, message)
     await handler.handle_anti_channels()
-    update_cache()
 
 
 @Client.on_message(filters.command(["delete_history", "dh"], prefix))
@@ -249,7 +296,7 @@ async def ro(client: Client, message: Message):
             perms.can_invite_users,
             perms.can_pin_messages,
         ]
-        db.set("core.ats", f"ro{message.chat.id}", perms_list)
+        await db.aset("core.ats", f"ro{message.chat.id}", perms_list)
 
         try:
             await client.set_chat_permissions(message.chat.id, ChatPermissions())
@@ -271,7 +318,7 @@ async def unro(client: Client, message: Message):
         return
 
     try:
-        perms_list = db.get(
+        perms_list = await db.aget(
             "core.ats",
             f"ro{message.chat.id}",
             [True, True, False, False, False, False, False],
@@ -303,7 +350,6 @@ async def unro(client: Client, message: Message):
 async def antiraid(client: Client, message: Message):
     handler = AntiRaidHandler(client, message)
     await handler.handle_antiraid()
-    update_cache()
 
 
 @Client.on_message(filters.command(["welcome", "wc"], prefix) & filters.me)
@@ -313,18 +359,21 @@ async def welcome(_, message: Message):
 
     if len(message.command) > 1:
         text = message.text.split(maxsplit=1)[1]
-        db.set("core.ats", f"welcome_enabled{message.chat.id}", True)
-        db.set("core.ats", f"welcome_text{message.chat.id}", text)
+        await db.aset_many(
+            "core.ats",
+            {
+                f"welcome_enabled{message.chat.id}": True,
+                f"welcome_text{message.chat.id}": text,
+            },
+        )
 
         await message.edit(
             f"<b>Welcome enabled in this chat\nText:</b> <code>{text}</code>"
         )
     else:
-        db.set("core.ats", f"welcome_enabled{message.chat.id}", False)
+        await db.aset("core.ats", f"welcome_enabled{message.chat.id}", False)
         await message.edit("<b>Welcome disabled in this chat</b>")
 
-    update_cache()
-
 
 modules_help["admintool"] = {
     "ban [reply]/[username/id]* [reason] [report_spam] [delete_history]": "ban user in chat",
@@ -24,6 +24,7 @@ from pyrogram.types import Message
 from utils.misc import modules_help, prefix
 from utils.scripts import ReplyCheck
 from utils.db import db
+from utils.prefilter import when
 
 # Variables
 AFK = False
@@ -48,7 +49,8 @@ def subtract_time(start, end):
 
 
 @Client.on_message(
-    ((filters.group & filters.mentioned) | filters.private)
+    when(lambda: AFK)
+    & ((filters.group & filters.mentioned) | filters.private)
     & ~filters.me
     & ~filters.service,
     group=3,
@@ -60,7 +62,7 @@ async def collect_afk_messages(bot: Client, message: Message):
         CHAT_TYPE = GROUPS if is_group else USERS
 
         if GetChatID(message) not in CHAT_TYPE:
-            text = db.get("core.afk", "afk_msg", None)
+            text = await db.aget("core.afk", "afk_msg", None)
             if text is None:
                 text = (
                     f"<b>Beep boop. This is an automated message.\n"
@@ -176,10 +178,10 @@ async def set_afk_msg(_, message: Message):
             "AFK message should contain <code>{last_seen}</code> to indicate where the last seen time will be placed."
         )
 
-    old_afk_msg = db.get("core.afk", "afk_msg", None)
+    old_afk_msg = await db.aget("core.afk", "afk_msg", None)
     if old_afk_msg:
-        db.remove("core.afk", "afk_msg")
-    db.set("core.afk", "afk_msg", afk_msg)
+        await db.aremove("core.afk", "afk_msg")
+    await db.aset("core.afk", "afk_msg", afk_msg)
     await message.edit(f"AFK message set to:\n\n{afk_msg}")
 
 
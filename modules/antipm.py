@@ -20,17 +20,27 @@ from pyrogram.types import Message
 
 from utils.config import pm_limit
 from utils.db import db
+from utils.entities import entities
 from utils.misc import modules_help, prefix
+from utils.workqueue import WorkQueue, queued
+
+
+async def anti_pm_status(_, __, ___):
+    return await db.aget("core.antipm", "status", False)
 
-anti_pm_enabled = filters.create(
-    lambda _, __, ___: db.get("core.antipm", "status", False)
-)
+
+anti_pm_enabled = filters.create(anti_pm_status)
 
 in_contact_list = filters.create(lambda _, __, message: message.from_user.is_contact)
 
 is_support = filters.create(lambda _, __, message: message.chat.is_support)
 
-USER_WARNINGS = {}
+# Warnings are forgotten after a day without new messages
+WARNINGS_TTL = 24 * 60 * 60
+
+# Messages of one chat are handled in order, so no warning gets lost.
+# More pending messages than pm_limit end in a block anyway
+warn_queue = WorkQueue("antipm", per_chat=1, max_pending=pm_limit + 1)
 
 
 @Client.on_message(
@@ -41,14 +51,28 @@ USER_WARNINGS = {}
     & ~is_support
     & anti_pm_enabled
 )
+@queued(warn_queue)
 async def anti_pm_handler(client: Client, message: Message):
     user_id = message.from_user.id
     ids = message.chat.id
-    b_f = await client.get_me()
+    b_f = await entities.get_me(client)
     u_n = b_f.first_name
-    user = await client.get_users(ids)
+    user = await entities.get_users(client, ids)
     u_f = user.first_name
-    default_text = db.get("core.antipm", "antipm_msg", None)
+    settings = await db.aget_many(
+        "core.antipm",
+        [
+            "antipm_msg",
+            "antipm_pic",
+            "spamrep",
+            "block",
+            f"allowusers{ids}",
+            f"disallowusers{ids}",
+            f"warns{user_id}",
+        ],
+    )
+    warns = settings.get(f"warns{user_id}", 0)
+    default_text = settings.get("antipm_msg")
     if default_text is None:
         default_text = f"""<b>Hello, {u_f}!
 This is the Assistant Of {u_n}.</b>
@@ -56,49 +80,43 @@ This is the Assistant Of {u_n}.</b>
 Do not spam further messages else I may have to block you!</i>
 
 <b>This is an automated message by the assistant.</b>
-<b><u>Currently You Have <code>{USER_WARNINGS.get(user_id, 0)}</code> Warnings.</u></b>
+<b><u>Currently You Have <code>{warns}</code> Warnings.</u></b>
     """
     else:
-        default_text = default_text.format(
-            user=u_f, my_name=u_n, warns=USER_WARNINGS.get(user_id, 0)
-        )
+        default_text = default_text.format(user=u_f, my_name=u_n, warns=warns)
 
-    if db.get("core.antipm", "spamrep", False):
-        user_info = await client.resolve_peer(ids)
+    if settings.get("spamrep", False):
+        user_info = await entities.resolve_peer(client, ids)
         await client.invoke(functions.messages.ReportSpam(peer=user_info))
 
-    if db.get("core.antipm", "block", False):
+    if settings.get("block", False):
         await client.block_user(user_id)
 
-    if db.get("core.antipm", f"disallowusers{ids}") == user_id != db.get(
-        "core.antipm", f"allowusers{ids}"
-    ) or db.get("core.antipm", f"disallowusers{ids}") != user_id != db.get(
-        "core.antipm", f"allowusers{ids}"
-    ):
-        default_pic = db.get("core.antipm", "antipm_pic", None)
+    allowed = settings.get(f"allowusers{ids}")
+    disallowed = settings.get(f"disallowusers{ids}")
+    if disallowed == user_id != allowed or disallowed != user_id != allowed:
+        default_pic = settings.get("antipm_pic")
         if default_pic:
             await client.send_photo(message.chat.id, default_pic, caption=default_text)
         else:
             await client.send_message(message.chat.id, default_text)
 
-        if user_id in USER_WARNINGS:
-            USER_WARNINGS[user_id] += 1
-        else:
-            USER_WARNINGS[user_id] = 1
-
-        if USER_WARNINGS[user_id] > pm_limit:
+        warns += 1
+        if warns > pm_limit:
             await client.send_message(
                 message.chat.id,
                 "<b>Ehm...! That was your Last warn, Bye Bye see you L0L</b>",
             )
             await client.block_user(user_id)
-            del USER_WARNINGS[user_id]
+            await db.aremove("core.antipm", f"warns{user_id}")
+        else:
+            await db.aset("core.antipm", f"warns{user_id}", warns, ttl=WARNINGS_TTL)
 
 
 @Client.on_message(filters.command(["antipm", "anti_pm"], prefix) & filters.me)
 async def anti_pm(_, message: Message):
     if len(message.command) == 1:
-        if db.get("core.antipm", "status", False):
+        if await db.aget("core.antipm", "status", False):
             await message.edit(
                 "<b>Anti-PM status: enabled\n"
                 f"Disable with: </b><code>{prefix}antipm disable</code>"
@@ -109,10 +127,10 @@ async def anti_pm(_, message: Message):
                 f"Enable with: </b><code>{prefix}antipm enable</code>"
             )
     elif message.command[1] in ["enable", "on", "1", "yes", "true"]:
-        db.set("core.antipm", "status", True)
+        await db.aset("core.antipm", "status", True)
         await message.edit("<b>Anti-PM enabled!</b>")
     elif message.command[1] in ["disable", "off", "0", "no", "false"]:
-        db.set("core.antipm", "status", False)
+        await db.aset("core.antipm", "status", False)
         await message.edit("<b>Anti-PM disabled!</b>")
     else:
         await message.edit(f"<b>Usage: {prefix}antipm [enable|disable]</b>")
@@ -121,7 +139,7 @@ async def anti_pm(_, message: Message):
 @Client.on_message(filters.command(["antipm_report"], prefix) & filters.me)
 async def antipm_report(_, message: Message):
     if len(message.command) == 1:
-        if db.get("core.antipm", "spamrep", False):
+        if await db.aget("core.antipm", "spamrep", False):
             await message.edit(
                 "<b>Spam-reporting enabled.\n"
                 f"Disable with: </b><code>{prefix}antipm_report disable</code>"
@@ -132,10 +150,10 @@ async def antipm_report(_, message: Message):
                 f"Enable with: </b><code>{prefix}antipm_report enable</code>"
             )
     elif message.command[1] in ["enable", "on", "1", "yes", "true"]:
-        db.set("core.antipm", "spamrep", True)
+        await db.aset("core.antipm", "spamrep", True)
         await message.edit("<b>Spam-reporting enabled!</b>")
     elif message.command[1] in ["disable", "off", "0", "no", "false"]:
-        db.set("core.antipm", "spamrep", False)
+        await db.aset("core.antipm", "spamrep", False)
         await message.edit("<b>Spam-reporting disabled!</b>")
     else:
         await message.edit(f"<b>Usage: {prefix}antipm_report [enable|disable]</b>")
@@ -144,7 +162,7 @@ async def antipm_report(_, message: Message):
 @Client.on_message(filters.command(["antipm_block"], prefix) & filters.me)
 async def antipm_block(_, message: Message):
     if len(message.command) == 1:
-        if db.get("core.antipm", "block", False):
+        if await db.aget("core.antipm", "block", False):
             await message.edit(
                 "<b>Blocking users enabled.\n"
                 f"Disable with: </b><code>{prefix}antipm_block disable</code>"
@@ -155,10 +173,10 @@ async def antipm_block(_, message: Message):
                 f"Enable with: </b><code>{prefix}antipm_block enable</code>"
             )
     elif message.command[1] in ["enable", "on", "1", "yes", "true"]:
-        db.set("core.antipm", "block", True)
+        await db.aset("core.antipm", "block", True)
         await message.edit("<b>Blocking users enabled!</b>")
     elif message.command[1] in ["disable", "off", "0", "no", "false"]:
-        db.set("core.antipm", "block", False)
+        await db.aset("core.antipm", "block", False)
         await message.edit("<b>Blocking users disabled!</b>")
     else:
         await message.edit(f"<b>Usage: {prefix}antipm_block [enable|disable]</b>")
@@ -168,9 +186,8 @@ async def antipm_block(_, message: Message):
 async def add_contact(_, message: Message):
     ids = message.chat.id
 
-    db.set("core.antipm", f"allowusers{ids}", ids)
-    if ids in USER_WARNINGS:
-        del USER_WARNINGS[ids]
+    await db.aset("core.antipm", f"allowusers{ids}", ids)
+    await db.aremove("core.antipm", f"warns{ids}")
     await message.edit("User Approved!")
 
 
@@ -178,15 +195,15 @@ async def add_contact(_, message: Message):
 async def del_contact(_, message: Message):
     ids = message.chat.id
 
-    db.set("core.antipm", f"disallowusers{ids}", ids)
-    db.remove("core.antipm", f"allowusers{ids}")
+    await db.aset("core.antipm", f"disallowusers{ids}", ids)
+    await db.aremove("core.antipm", f"allowusers{ids}")
     await message.edit("User DisApproved!")
 
 
 @Client.on_message(filters.command(["setantipmmsg", "sam"], prefix) & filters.me)
 async def set_antipm_msg(_, message: Message):
     if not message.reply_to_message:
-        db.set("core.antipm", "antipm_msg", None)
+        await db.aset("core.antipm", "antipm_msg", None)
         await message.edit("antipm message set to default.")
         return
 
@@ -216,27 +233,27 @@ async def set_antipm_msg(_, message: Message):
             "antipm message must contain <code>{warns}</code> to mention the warns count."
         )
 
-    old_afk_msg = db.get("core.antipm", "antipm_msg", None)
+    old_afk_msg = await db.aget("core.antipm", "antipm_msg", None)
     if old_afk_msg:
-        db.remove("core.antipm", "antipm_msg")
-    db.set("core.antipm", "antipm_msg", afk_msg)
+        await db.aremove("core.antipm", "antipm_msg")
+    await db.aset("core.antipm", "antipm_msg", afk_msg)
     await message.edit(f"antipm message set to:\n\n{afk_msg}")
 
 
 @Client.on_message(filters.command(["setantipmpic", "sap"], prefix) & filters.me)
 async def set_antipm_pic(_, message: Message):
     if not message.reply_to_message or not message.reply_to_message.photo:
-        db.set("core.antipm", "antipm_pic", None)
+        await db.aset("core.antipm", "antipm_pic", None)
         await message.edit("antipm picture set to default.")
         return
 
     photo = message.reply_to_message.photo
     file_id = photo.file_id
 
-    old_antipm_pic = db.get("core.antipm", "antipm_pic", None)
+    old_antipm_pic = await db.aget("core.antipm", "antipm_pic", None)
     if old_antipm_pic:
-        db.remove("core.antipm", "antipm_pic")
-    db.set("core.antipm", "antipm_pic", file_id)
+        await db.aremove("core.antipm", "antipm_pic")
+    await db.aset("core.antipm", "antipm_pic", file_id)
     await message.edit("antipm picture set successfully.")
 
 
@@ -1,3 +1,6 @@
+import asyncio
+import functools
+
 from pyrogram import Client, enums, filters
 from pyrogram.types import Message
 
@@ -5,6 +8,7 @@ from utils.misc import modules_help, prefix
 from utils.config import cohere_key
 from utils.db import db
 from utils.scripts import format_exc, import_library, restart
+from utils.workqueue import WorkQueue, queued
 
 cohere = import_library("cohere")
 
@@ -12,6 +16,9 @@ co = cohere.Client(cohere_key)
 
 chatai_users = db.getaiusers()
 
+# One reply at a time per chat keeps the conversation history in order
+replies = WorkQueue("chatbot", concurrency=2, per_chat=1, max_pending=5)
+
 
 @Client.on_message(filters.command("addai", prefix))
 async def adduser(_, message: Message):
@@ -28,6 +35,8 @@ async def adduser(_, message: Message):
     else:
         await message.edit_text(f"<b>Usage: </b><code>{prefix}addai [user_id]</code>")
         return
+
+
 @Client.on_message(filters.command("remai", prefix))
 async def remuser(_, message: Message):
     if len(message.command) > 1:
@@ -46,6 +55,7 @@ async def remuser(_, message: Message):
 
 
 @Client.on_message(filters.user(users=chatai_users) & filters.text)
+@queued(replies)
 async def chatbot(_, message: Message):
     user_id = message.chat.id
 
@@ -56,22 +66,30 @@ async def chatbot(_, message: Message):
     try:
         await message.reply_chat_action(enums.ChatAction.TYPING)
 
-        chat_history = db.get_chat_history(user_id)
+        chat_history = await db.aget_chat_history(user_id)
 
         prompt = message.text
 
-        db.add_chat_history(user_id, {"role": "USER", "message": prompt})
-
-        response = co.chat(
-            chat_history=chat_history,
-            model="command-r-plus",
-            message=prompt,
-            temperature=0.3,
-            connectors=[{"id": "web-search", "options": {"site": "wikipedia.com"}}],
-            prompt_truncation="AUTO",
+        await db.aadd_chat_history(user_id, {"role": "USER", "message": prompt})
+
+        # The cohere client blocks, keep it off the loop so the queue's
+        # concurrency lets replies for different chats overlap
+        response = await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                co.chat,
+                chat_history=chat_history,
+                model="command-r-plus",
+                message=prompt,
+                temperature=0.3,
+                connectors=[{"id": "web-search", "options": {"site": "wikipedia.com"}}],
+                prompt_truncation="AUTO",
+            ),
         )
 
-        db.add_chat_history(user_id, {"role": "CHATBOT", "message": response.text})
+        await db.aadd_chat_history(
+            user_id, {"role": "CHATBOT", "message": response.text}
+        )
 
         await message.reply_text(
             f"{response.text}", parse_mode=enums.ParseMode.MARKDOWN
@@ -83,11 +101,27 @@ async def chatbot(_, message: Message):
 
 @Client.on_message(filters.command("chatoff", prefix) & filters.me)
 async def chatoff(_, message: Message):
-    db.remove("core.chatbot", "chatai_users")
+    await db.aremove("core.chatbot", "chatai_users")
     await message.reply_text("<b>ChatBot is off now</b>")
     restart()
 
 
+@Client.on_message(filters.command("resetai", prefix) & filters.me)
+async def resetai(_, message: Message):
+    if len(message.command) > 1:
+        user_id = message.command[1]
+        if not user_id.lstrip("-").isdigit():
+            await message.edit_text("<b>User ID is invalid.</b>")
+            return
+        user_id = int(user_id)
+    else:
+        user_id = message.chat.id
+    await db.aclear_chat_history(user_id)
+    await message.edit_text(
+        f"<b>Chat history of</b> <code>{user_id}</code> <b>cleared</b>"
+    )
+
+
 @Client.on_message(filters.command("listai", prefix) & filters.me)
 async def listai(_, message: Message):
     await message.edit_text(
@@ -99,5 +133,6 @@ modules_help["chatbot"] = {
     "addai [user_id]*": "Add A user to AI ChatBot List",
     "remai [user_id]*": "Remove A user from AI ChatBot List",
     "listai": "List A user from AI ChatBot List",
+    "resetai [user_id]": "Clear AI ChatBot history of the user (or this chat)",
     "chatoff": "Turn off AI ChatBot",
-}
\ No newline at end of file
+}
@@ -37,7 +37,7 @@ async def global_mention_clear(client: Client, message: Message):
         result = await client.invoke(request)
     except FloodWait as e:
         await message.edit_text(
-            f"<b>FloodWait received. Wait {e.x} seconds before trying again</b>"
+            f"<b>FloodWait received. Wait {e.value} seconds before trying again</b>"
         )
         return
     await message.delete()
@@ -66,7 +66,7 @@ async def global_reaction_clear(client: Client, message: Message):
         result = await client.invoke(request)
     except FloodWait as e:
         await message.edit_text(
-            f"<b>FloodWait received. Wait {e.x} seconds before trying again</b>"
+            f"<b>FloodWait received. Wait {e.value} seconds before trying again</b>"
         )
         return
     await message.delete()
@@ -5,7 +5,10 @@ import asyncio
 
 from pyrogram import Client, filters
 from pyrogram.types import Message
+from utils.editor import edits
 from utils.misc import modules_help
+from utils.prefilter import text_contains
+from utils.workqueue import WorkQueue, queued
 
 # --- API Configuration ---
 API_URL = "https://socialdown.itz-ashlynn.workers.dev"
@@ -16,6 +19,9 @@ SUPPORTED_DOMAINS = [
     "twitter.com", "tiktok.com", "capcut.com", "youtube.com", "youtu.be"
 ]
 
+# Downloads run in the background, two at a time and one per chat
+downloads = WorkQueue("downloader3", concurrency=2, per_chat=1, max_pending=3)
+
 # --- Helper Functions ---
 async def post_json(url, data):
     """Posts JSON data to a URL and returns the JSON response."""
@@ -48,18 +54,15 @@ async def download_file(url, file_path, status_msg, referer_url):
                 
                 total_size = int(response.headers.get('content-length', 0))
                 downloaded_size = 0
-                last_update = asyncio.get_event_loop().time()
 
                 with open(file_path, 'wb') as f:
                     async for chunk in response.content.iter_chunked(1024 * 1024):
                         f.write(chunk)
                         downloaded_size += len(chunk)
-                        
-                        current_time = asyncio.get_event_loop().time()
-                        if total_size > 0 and (current_time - last_update) > 2:
+
+                        if total_size > 0:
                             progress = (downloaded_size / total_size) * 100
-                            await status_msg.edit_text(f"<code>Downloading... {progress:.1f}%</code>")
-                            last_update = current_time
+                            edits.update(status_msg, f"<code>Downloading... {progress:.1f}%</code>")
                 return True, None
     except Exception as e:
         return False, str(e)
@@ -71,7 +74,10 @@ def safe_filename(title, quality, ext):
     return f"{s_title}_{s_quality}.{ext}"
 
 # --- Main Handler ---
-@Client.on_message(filters.text & filters.regex(URL_REGEX) & ~filters.bot)
+@Client.on_message(
+    text_contains(SUPPORTED_DOMAINS) & filters.text & filters.regex(URL_REGEX) & ~filters.bot
+)
+@queued(downloads)
 async def ashlynn_auto_downloader(client: Client, message: Message):
     if message.edit_date or message.forward_date:
         return
@@ -193,10 +199,10 @@ async def ashlynn_auto_downloader(client: Client, message: Message):
             try:
                 success, error = await download_file(url, file_path, dl_status, referer_url=media_url)
                 if not success:
-                    await dl_status.edit_text(f"<code>❌ Download failed for {quality}. Reason: {error}</code>")
+                    await edits.final(dl_status, f"<code>❌ Download failed for {quality}. Reason: {error}</code>")
                     continue
 
-                await dl_status.edit_text(f"<code>Uploading '{quality}'...</code>")
+                await edits.final(dl_status, f"<code>Uploading '{quality}'...</code>")
                 caption = f"<b>{title}</b>\n<b>Quality:</b> <code>{quality}</code>"
                 
                 if file_type == "audio":
@@ -15,29 +15,66 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from pyrogram import Client, ContinuePropagation, errors, filters
-from pyrogram.types import (
-    InputMediaAudio,
-    InputMediaDocument,
-    InputMediaPhoto,
-    InputMediaVideo,
-    Message,
-)
+from pyrogram.types import Message
 
-from utils.db import db
+from utils.db import REMOVED, db
+from utils.media import media_cache
 from utils.misc import modules_help, prefix
 from utils.scripts import format_exc
+from utils.triggers import CONTAINS, EXACT, WORD, TriggerIndex
+
+MODE_FLAGS = {"-c": CONTAINS, "-w": WORD}
+
+
+async def get_filters_chat(chat_id):
+    return await db.aget("core.filters", f"{chat_id}", {})
+
+
+async def set_filters_chat(chat_id, filters_):
+    return await db.aset("core.filters", f"{chat_id}", filters_)
 
 
-def get_filters_chat(chat_id):
-    return db.get("core.filters", f"{chat_id}", {})
+def build_index(chat_filters: dict) -> TriggerIndex:
+    index = TriggerIndex()
+    for name, value in chat_filters.items():
+        index.add(name, value, value.get("MODE", EXACT))
+    return index
 
 
-def set_filters_chat(chat_id, filters_):
-    return db.set("core.filters", f"{chat_id}", filters_)
+# Trigger index per chat, kept in sync with the database by update_indexes()
+chat_indexes = {
+    int(chat_id): build_index(chat_filters)
+    for chat_id, chat_filters in db.get_collection("core.filters").items()
+}
+
+
+def update_indexes(variable, value):
+    if variable is None:
+        collection = db.get_collection("core.filters")
+        chat_indexes.clear()
+        for chat_id, chat_filters in collection.items():
+            chat_indexes[int(chat_id)] = build_index(chat_filters)
+    elif value is REMOVED or not value:
+        chat_indexes.pop(int(variable), None)
+    else:
+        chat_indexes[int(variable)] = build_index(value)
+
+
+db.subscribe("core.filters", update_indexes)
 
 
 async def contains_filter(_, __, m):
-    return m.text and m.text.lower() in get_filters_chat(m.chat.id).keys()
+    index = chat_indexes.get(m.chat.id)
+    if not index or not m.text:
+        return False
+    match = index.match(m.text.lower())
+    if match is None:
+        return False
+    if m.outgoing and match[1].get("MODE", EXACT) != EXACT:
+        # The answer may contain its trigger, don't answer it again
+        return False
+    m.filter_value = match[1]
+    return True
 
 
 contains = filters.create(contains_filter)
@@ -46,84 +83,25 @@ contains = filters.create(contains_filter)
 # noinspection PyTypeChecker
 @Client.on_message(contains)
 async def filters_main_handler(client: Client, message: Message):
-    value = get_filters_chat(message.chat.id)[message.text.lower()]
+    value = message.filter_value
+    chat_id, message_id = int(value["CHAT_ID"]), int(value["MESSAGE_ID"])
     try:
-        await client.get_messages(int(value["CHAT_ID"]), int(value["MESSAGE_ID"]))
+        if value.get("MEDIA_GROUP"):
+            media = await media_cache.get_media_group(client, chat_id, message_id)
+            await client.send_media_group(
+                message.chat.id, media, reply_to_message_id=message.id
+            )
+        elif await media_cache.message_exists(client, chat_id, message_id):
+            await client.copy_message(
+                message.chat.id,
+                chat_id,
+                message_id,
+                reply_to_message_id=message.id,
+            )
     except errors.RPCError as exc:
+        # The stored message is gone or unreachable, check it again next time
+        media_cache.invalidate(chat_id, message_id)
         raise ContinuePropagation from exc
-
-    if value.get("MEDIA_GROUP"):
-        messages_grouped = await client.get_media_group(
-            int(value["CHAT_ID"]), int(value["MESSAGE_ID"])
-        )
-        media_grouped_list = []
-        for _ in messages_grouped:
-            if _.photo:
-                if _.caption:
-                    media_grouped_list.append(
-                        InputMediaPhoto(_.photo.file_id, _.caption.HTML)
-                    )
-                else:
-                    media_grouped_list.append(InputMediaPhoto(_.photo.file_id))
-            elif _.video:
-                if _.caption:
-                    if _.video.thumbs:
-                        media_grouped_list.append(
-                            InputMediaVideo(
-                                _.video.file_id,
-                                _.video.thumbs[0].file_id,
-                                _.caption.HTML,
-                            )
-                        )
-                    else:
-                        media_grouped_list.append(
-                            InputMediaVideo(_.video.file_id, _.caption.HTML)
-                        )
-                elif _.video.thumbs:
-                    media_grouped_list.append(
-                        InputMediaVideo(_.video.file_id, _.video.thumbs[0].file_id)
-                    )
-                else:
-                    media_grouped_list.append(InputMediaVideo(_.video.file_id))
-            elif _.audio:
-                if _.caption:
-                    media_grouped_list.append(
-                        InputMediaAudio(_.audio.file_id, _.caption.HTML)
-                    )
-                else:
-                    media_grouped_list.append(InputMediaAudio(_.audio.file_id))
-            elif _.document:
-                if _.caption:
-                    if _.document.thumbs:
-                        media_grouped_list.append(
-                            InputMediaDocument(
-                                _.document.file_id,
-                                _.document.thumbs[0].file_id,
-                                _.caption.HTML,
-                            )
-                        )
-                    else:
-                        media_grouped_list.append(
-                            InputMediaDocument(_.document.file_id, _.caption.HTML)
-                        )
-                elif _.document.thumbs:
-                    media_grouped_list.append(
-                        InputMediaDocument(
-                            _.document.file_id, _.document.thumbs[0].file_id
-                        )
-                    )
-                else:
-                    media_grouped_list.append(InputMediaDocument(_.document.file_id))
-        await client.send_media_group(
-            message.chat.id, media_grouped_list, reply_to_message_id=message.id
-        )
-    else:
-        await client.copy_message(
-            message.chat.id,
-            int(value["CHAT_ID"]),
-            int(value["MESSAGE_ID"]),
-            reply_to_message_id=message.id,
-        )
     raise ContinuePropagation
 
 
@@ -132,10 +110,17 @@ async def filter_handler(client: Client, message: Message):
     try:
         if len(message.text.split()) < 2:
             return await message.edit(
-                f"<b>Usage</b>: <code>{prefix}filter [name] (Reply required)</code>"
+                f"<b>Usage</b>: <code>{prefix}filter [-c|-w] [name] "
+                "(Reply required)</code>"
             )
-        name = message.text.split(maxsplit=1)[1].lower()
-        chat_filters = get_filters_chat(message.chat.id)
+        args = message.text.split(maxsplit=2)
+        if args[1] in MODE_FLAGS and len(args) > 2:
+            mode = MODE_FLAGS[args[1]]
+            name = args[2].lower()
+        else:
+            mode = EXACT
+            name = message.text.split(maxsplit=1)[1].lower()
+        chat_filters = await get_filters_chat(message.chat.id)
         if name in chat_filters.keys():
             return await message.edit(
                 f"<b>Filter</b> <code>{name}</code> already exists."
@@ -144,13 +129,13 @@ async def filter_handler(client: Client, message: Message):
             return await message.edit("<b>Reply to message</b> please.")
 
         try:
-            chat = await client.get_chat(db.get("core.notes", "chat_id", 0))
+            chat = await client.get_chat(await db.aget("core.notes", "chat_id", 0))
         except (errors.RPCError, ValueError, KeyError):
             # group is not accessible or isn't created
             chat = await client.create_supergroup(
                 "Moon_Userbot_Notes_Filters", "Don't touch this group, please"
             )
-            db.set("core.notes", "chat_id", chat.id)
+            await db.aset("core.notes", "chat_id", chat.id)
 
         chat_id = chat.id
 
@@ -174,6 +159,7 @@ async def filter_handler(client: Client, message: Message):
                 "MESSAGE_ID": str(message_id[1].id),
                 "MEDIA_GROUP": True,
                 "CHAT_ID": str(chat_id),
+                "MODE": mode,
             }
         else:
             try:
@@ -184,11 +170,12 @@ async def filter_handler(client: Client, message: Message):
                 "MEDIA_GROUP": False,
                 "MESSAGE_ID": str(message_id.id),
                 "CHAT_ID": str(chat_id),
+                "MODE": mode,
             }
 
         chat_filters.update({name: filter_})
 
-        set_filters_chat(message.chat.id, chat_filters)
+        await set_filters_chat(message.chat.id, chat_filters)
         return await message.edit(
             f"<b>Filter</b> <code>{name}</code> has been added.",
         )
@@ -200,10 +187,14 @@ async def filter_handler(client: Client, message: Message):
 async def filters_handler(_, message: Message):
     try:
         text = ""
-        for index, a in enumerate(get_filters_chat(message.chat.id).items(), start=1):
-            key, _ = a
+        for index, a in enumerate(
+            (await get_filters_chat(message.chat.id)).items(), start=1
+        ):
+            key, value = a
             key = key.replace("<", "").replace(">", "")
-            text += f"{index}. <code>{key}</code>\n"
+            mode = value.get("MODE", EXACT)
+            text += f"{index}. <code>{key}</code>"
+            text += "\n" if mode == EXACT else f" ({mode})\n"
         text = f"<b>Your filters in current chat</b>:\n\n" f"{text}"
         text = text[:4096]
         return await message.edit(text)
@@ -221,13 +212,13 @@ async def filter_del_handler(_, message: Message):
                 f"<b>Usage</b>: <code>{prefix}fdel [name]</code>",
             )
         name = message.text.split(maxsplit=1)[1].lower()
-        chat_filters = get_filters_chat(message.chat.id)
+        chat_filters = await get_filters_chat(message.chat.id)
         if name not in chat_filters.keys():
             return await message.edit(
                 f"<b>Filter</b> <code>{name}</code> doesn't exists.",
             )
         del chat_filters[name]
-        set_filters_chat(message.chat.id, chat_filters)
+        await set_filters_chat(message.chat.id, chat_filters)
         return await message.edit(
             f"<b>Filter</b> <code>{name}</code> has been deleted.",
         )
@@ -243,7 +234,7 @@ async def filter_search_handler(_, message: Message):
                 f"<b>Usage</b>: <code>{prefix}fsearch [name]</code>",
             )
         name = message.text.split(maxsplit=1)[1].lower()
-        chat_filters = get_filters_chat(message.chat.id)
+        chat_filters = await get_filters_chat(message.chat.id)
         if name not in chat_filters.keys():
             return await message.edit(
                 f"<b>Filter</b> <code>{name}</code> doesn't exists.",
@@ -257,7 +248,9 @@ async def filter_search_handler(_, message: Message):
 
 
 modules_help["filters"] = {
-    "filter [name]": "Create filter (Reply required)",
+    "filter [-c|-w] [name]": "Create filter (Reply required). "
+    "By default the whole message must match, with -c the name can be anywhere "
+    "in the message and with -w it must be a separate word",
     "filters": "List of all triggers",
     "fdel [name]": "Delete filter by name",
     "fsearch [name]": "Info filter by name",
@@ -3,7 +3,7 @@ import sqlite3
 from datetime import datetime
 import asyncio
 
-from pyrogram import Client, filters
+from pyrogram import Client, enums, filters
 from pyrogram.types import Message
 
 from utils.misc import modules_help, prefix
@@ -63,8 +63,18 @@ ABOUT_HACKERGPT = {
     )
 }
 
+async def _group_activated(_, __, message: Message) -> bool:
+    """Cheap check before the handler: is the sender activated, or activating now?"""
+    if not message.from_user or not message.text:
+        return False
+    key = (message.chat.id, message.from_user.id)
+    return key in group_user_activation or "dark" in message.text.lower()
+
+
+group_activated = filters.create(_group_activated)
+
 # --- Main AI Handler ---
-@Client.on_message(filters.command(["hai"], prefix) | (filters.group & ~filters.command(prefix) & filters.text))
+@Client.on_message(filters.command(["hai"], prefix) | (group_activated & filters.group & ~filters.command(prefix) & filters.text))
 async def handle_ai_message(client: Client, message: Message):
     is_self = message.from_user and message.from_user.is_self
     user_id = message.from_user.id
@@ -83,7 +93,7 @@ async def handle_ai_message(client: Client, message: Message):
         user_text = message.text
 
     # Group activation logic: activate on ".ai" or if "dark" is in the message
-    if message.chat.type in ["group", "supergroup"]:
+    if message.chat.type in (enums.ChatType.GROUP, enums.ChatType.SUPERGROUP):
         key = (chat_id, user_id)
         if "dark" in user_text.lower() or (message.command and message.command[0].lower() == "ai"):
             group_user_activation[key] = True
@@ -25,7 +25,7 @@ from pyrogram import Client, filters
 from pyrogram.types import Message
 
 from utils.misc import modules_help, prefix
-from utils.scripts import restart
+from utils.scripts import RESTART_INFO_TTL, restart
 from utils.db import db
 
 
@@ -159,21 +159,23 @@ async def loadmod(_, message: Message):
         os.rename(file_name, f"./modules/custom_modules/{module_name}.py")
 
     all_modules = db.get("custom.modules", "allModules", [])
-    if module_name not in all_modules:
-        all_modules.append(module_name)
-        db.set("custom.modules", "allModules", all_modules)
+    with db.transaction():
+        if module_name not in all_modules:
+            all_modules.append(module_name)
+            db.set("custom.modules", "allModules", all_modules)
+        db.set(
+            "core.updater",
+            "restart_info",
+            {
+                "type": "restart",
+                "chat_id": message.chat.id,
+                "message_id": message.id,
+            },
+            ttl=RESTART_INFO_TTL,
+        )
     await message.edit(
         f"<b>The module <code>{module_name}</code> is loaded!\nRestarting...</b>"
     )
-    db.set(
-        "core.updater",
-        "restart_info",
-        {
-            "type": "restart",
-            "chat_id": message.chat.id,
-            "message_id": message.id,
-        },
-    )
     restart()
 
 
@@ -198,21 +200,23 @@ async def unload_mods(_, message: Message):
             )
             shutil.rmtree(f"{BASE_PATH}/musicbot")
         all_modules = db.get("custom.modules", "allModules", [])
-        if module_name in all_modules:
-            all_modules.remove(module_name)
-            db.set("custom.modules", "allModules", all_modules)
+        with db.transaction():
+            if module_name in all_modules:
+                all_modules.remove(module_name)
+                db.set("custom.modules", "allModules", all_modules)
+            db.set(
+                "core.updater",
+                "restart_info",
+                {
+                    "type": "restart",
+                    "chat_id": message.chat.id,
+                    "message_id": message.id,
+                },
+                ttl=RESTART_INFO_TTL,
+            )
         await message.edit(
             f"<b>The module <code>{module_name}</code> removed!\nRestarting...</b>"
         )
-        db.set(
-            "core.updater",
-            "restart_info",
-            {
-                "type": "restart",
-                "chat_id": message.chat.id,
-                "message_id": message.id,
-            },
-        )
         restart()
     elif os.path.exists(f"{BASE_PATH}/modules/{module_name}.py"):
         await message.edit(
@@ -259,6 +263,7 @@ async def load_all_mods(_, message: Message):
             "chat_id": message.chat.id,
             "message_id": message.id,
         },
+        ttl=RESTART_INFO_TTL,
     )
     restart()
 
@@ -270,18 +275,19 @@ async def unload_all_mods(_, message: Message):
     if not os.path.exists(f"{BASE_PATH}/modules/custom_modules"):
         return await message.edit("<b>You don't have any modules installed</b>")
     shutil.rmtree(f"{BASE_PATH}/modules/custom_modules")
-    db.set("custom.modules", "allModules", [])
+    with db.transaction():
+        db.set("custom.modules", "allModules", [])
+        db.set(
+            "core.updater",
+            "restart_info",
+            {
+                "type": "restart",
+                "chat_id": message.chat.id,
+                "message_id": message.id,
+            },
+            ttl=RESTART_INFO_TTL,
+        )
     await message.edit("<b>Successfully unloaded all modules!\nRestarting...</b>")
-
-    db.set(
-        "core.updater",
-        "restart_info",
-        {
-            "type": "restart",
-            "chat_id": message.chat.id,
-            "message_id": message.id,
-        },
-    )
     restart()
 
 
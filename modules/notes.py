@@ -27,20 +27,20 @@ async def save_note(client: Client, message: Message):
     await message.edit("<b>Loading...</b>")
 
     try:
-        chat = await client.get_chat(db.get("core.notes", "chat_id", 0))
+        chat = await client.get_chat(await db.aget("core.notes", "chat_id", 0))
     except (errors.RPCError, ValueError, KeyError):
         # group is not accessible or isn't created
         chat = await client.create_supergroup(
             "Moon_Userbot_Notes_Filters", "Don't touch this group, please"
         )
-        db.set("core.notes", "chat_id", chat.id)
+        await db.aset("core.notes", "chat_id", chat.id)
 
     chat_id = chat.id
 
     if message.reply_to_message and len(message.text.split()) >= 2:
         note_name = message.text.split(maxsplit=1)[1]
         if message.reply_to_message.media_group_id:
-            checking_note = db.get("core.notes", f"note{note_name}", False)
+            checking_note = await db.aget("core.notes", f"note{note_name}", False)
             if not checking_note:
                 get_media_group = [
                     _.id
@@ -62,12 +62,12 @@ async def save_note(client: Client, message: Message):
                     "MEDIA_GROUP": True,
                     "CHAT_ID": str(chat_id),
                 }
-                db.set("core.notes", f"note{note_name}", note)
+                await db.aset("core.notes", f"note{note_name}", note)
                 await message.edit(f"<b>Note {note_name} saved</b>")
             else:
                 await message.edit("<b>This note already exists</b>")
         else:
-            checking_note = db.get("core.notes", f"note{note_name}", False)
+            checking_note = await db.aget("core.notes", f"note{note_name}", False)
             if not checking_note:
                 try:
                     message_id = await message.reply_to_message.forward(chat_id)
@@ -78,13 +78,13 @@ async def save_note(client: Client, message: Message):
                     "MESSAGE_ID": str(message_id.id),
                     "CHAT_ID": str(chat_id),
                 }
-                db.set("core.notes", f"note{note_name}", note)
+                await db.aset("core.notes", f"note{note_name}", note)
                 await message.edit(f"<b>Note {note_name} saved</b>")
             else:
                 await message.edit("<b>This note already exists</b>")
     elif len(message.text.split()) >= 3:
         note_name = message.text.split(maxsplit=1)[1].split()[0]
-        checking_note = db.get("core.notes", f"note{note_name}", False)
+        checking_note = await db.aget("core.notes", f"note{note_name}", False)
         if not checking_note:
             message_id = await client.send_message(
                 chat_id, message.text.split(note_name)[1].strip()
@@ -94,7 +94,7 @@ async def save_note(client: Client, message: Message):
                 "MESSAGE_ID": str(message_id.id),
                 "CHAT_ID": str(chat_id),
             }
-            db.set("core.notes", f"note{note_name}", note)
+            await db.aset("core.notes", f"note{note_name}", note)
             await message.edit(f"<b>Note {note_name} saved</b>")
         else:
             await message.edit("<b>This note already exists</b>")
@@ -114,7 +114,7 @@ async def note_send(client: Client, message: Message):
 async def notes(_, message: Message):
     await message.edit("<b>Loading...</b>")
     text = "Available notes:\n\n"
-    collection = db.get_collection("core.notes")
+    collection = await db.aget_collection("core.notes")
     for note in collection.keys():
         if note[:4] == "note":
             text += f"<code>{note[4:]}</code>\n"
@@ -125,9 +125,9 @@ async def notes(_, message: Message):
 async def clear_note(_, message: Message):
     if len(message.text.split()) >= 2:
         note_name = message.text.split(maxsplit=1)[1]
-        find_note = db.get("core.notes", f"note{note_name}", False)
+        find_note = await db.aget("core.notes", f"note{note_name}", False)
         if find_note:
-            db.remove("core.notes", f"note{note_name}")
+            await db.aremove("core.notes", f"note{note_name}")
             await message.edit(f"<b>Note {note_name} deleted</b>")
         else:
             await message.edit("<b>There is no such note</b>")
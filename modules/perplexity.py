@@ -23,6 +23,8 @@ from pyrogram import Client, filters, enums
 from pyrogram.types import Message
 from pyrogram.errors import PeerIdInvalid
 
+from utils.editor import edits
+
 # Assuming these are part of your userbot framework which defines 'prefix'
 # and the 'modules_help' dictionary.
 try:
@@ -62,7 +64,8 @@ class ModuleConfig:
 # =========================================================================================
 # This section contains all the animation functions. Each function takes a
 # status message and a stop event, and it will loop its animation until
-# the stop event is set by the main logic.
+# the stop event is set by the main logic. Frames go through the shared
+# edit scheduler, which skips frames when the chat edit budget runs out.
 
 async def animate_progress_bar(status_message: Message, stop_event: asyncio.Event):
     """Effect 1: A dynamic, back-and-forth progress bar."""
@@ -78,7 +81,7 @@ async def animate_progress_bar(status_message: Message, stop_event: asyncio.Even
             emoji = emojis[i % len(emojis)]
             text = f"{base_text} {emoji}\n`[{progress}{spaces}]`"
             try:
-                await status_message.edit_text(text)
+                edits.update(status_message, text)
                 await asyncio.sleep(0.2)
             except Exception: return
         
@@ -92,7 +95,7 @@ async def animate_progress_bar(status_message: Message, stop_event: asyncio.Even
             emoji = emojis[i % len(emojis)]
             text = f"{base_text} {emoji}\n`[{progress}{spaces}]`"
             try:
-                await status_message.edit_text(text)
+                edits.update(status_message, text)
                 await asyncio.sleep(0.2)
             except Exception: return
 
@@ -108,7 +111,7 @@ async def animate_emoji_cycle(status_message: Message, stop_event: asyncio.Event
         for text, emoji in states:
             if stop_event.is_set(): break
             try:
-                await status_message.edit_text(f"{text} {emoji}")
+                edits.update(status_message, f"{text} {emoji}")
                 await asyncio.sleep(0.8)
             except Exception: return
 
@@ -120,7 +123,7 @@ async def animate_loading_dots(status_message: Message, stop_event: asyncio.Even
             if stop_event.is_set(): break
             dots = "." * i
             try:
-                await status_message.edit_text(f"{base_text}{dots}")
+                edits.update(status_message, f"{base_text}{dots}")
                 await asyncio.sleep(0.5)
             except Exception: return
 
@@ -136,7 +139,7 @@ async def animate_rocket_launch(status_message: Message, stop_event: asyncio.Eve
             sky = " " * (track_length - rocket_pos)
             text = f"{base_text}\n`[{trail}🚀{sky}]` 🌍"
             try:
-                await status_message.edit_text(text)
+                edits.update(status_message, text)
                 await asyncio.sleep(0.3)
             except Exception: return
         await asyncio.sleep(1)
@@ -151,7 +154,7 @@ async def animate_matrix_rain(status_message: Message, stop_event: asyncio.Event
         line2 = "".join(random.choice(chars) for _ in range(15))
         text = f"{base_text}\n`{line1}`\n`{line2}`"
         try:
-            await status_message.edit_text(text)
+            edits.update(status_message, text)
             await asyncio.sleep(0.2)
         except Exception: return
 
@@ -163,7 +166,7 @@ async def animate_clock(status_message: Message, stop_event: asyncio.Event):
         for face in clock_faces:
             if stop_event.is_set(): break
             try:
-                await status_message.edit_text(f"{base_text} {face}")
+                edits.update(status_message, f"{base_text} {face}")
                 await asyncio.sleep(0.5)
             except Exception: return
 
@@ -264,6 +267,8 @@ async def run_forwarder_with_animation(
         # This block ensures the animation always stops.
         stop_animation.set()
         await animation_task
+        # Drop the frame still waiting for the chat edit budget, if any
+        edits.cancel(status_message)
         # If not the owner, delete the temporary status message.
         # Owner's message is either edited or deleted by the fetcher function.
         if not is_owner and status_message:
@@ -289,7 +294,7 @@ async def fetch_pic_response(client: Client, message: Message, prompt: str, stat
     
     bot, last_message_id, error = await setup_bot_interaction(client, ModuleConfig.BOT_USERNAME)
     if error:
-        await status_message.edit(error)
+        await edits.final(status_message, error)
         await asyncio.sleep(3)
         return
 
@@ -349,7 +354,7 @@ async def fetch_pi_response(client: Client, message: Message, prompt: str, statu
     
     bot, last_message_id, error = await setup_bot_interaction(client, ModuleConfig.BOT_USERNAME)
     if error:
-        await status_message.edit(error)
+        await edits.final(status_message, error)
         await asyncio.sleep(3)
         return
 
@@ -395,7 +400,7 @@ async def fetch_pi_response(client: Client, message: Message, prompt: str, statu
                 # For owner, stop animation and edit the original message with the final text.
                 stop_event.set()
                 await asyncio.sleep(0.1)
-                await status_message.edit(final_text, parse_mode=enums.ParseMode.MARKDOWN)
+                await edits.final(status_message, final_text, parse_mode=enums.ParseMode.MARKDOWN)
             else:
                 # For other users, send the final text as a reply.
                 await client.send_message(
@@ -19,7 +19,7 @@ from pyrogram.types import Message
 
 from utils.db import db
 from utils.misc import modules_help, prefix
-from utils.scripts import restart
+from utils.scripts import RESTART_INFO_TTL, restart
 
 
 @Client.on_message(
@@ -40,6 +40,7 @@ async def setprefix(_, message: Message):
                 "chat_id": message.chat.id,
                 "message_id": message.id,
             },
+            ttl=RESTART_INFO_TTL,
         )
         restart()
     else:
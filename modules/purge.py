@@ -14,7 +14,6 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import asyncio
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
@@ -42,7 +41,6 @@ async def purge(client: Client, message: Message):
         if len(chunk) >= 100:
             await client.delete_messages(message.chat.id, chunk)
             chunk.clear()
-            await asyncio.sleep(1)
 
     if len(chunk) > 0:
         await client.delete_messages(message.chat.id, chunk)
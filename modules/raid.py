@@ -3,6 +3,7 @@ import random
 from pyrogram import Client, filters, enums
 from pyrogram.types import Message
 from utils.misc import modules_help, prefix
+from utils.prefilter import user_in
 
 # --- Data from data.py ---
 # Note: The following lists contain user-provided data.
@@ -1429,11 +1430,11 @@ async def drraid_command(client: Client, message: Message):
     else:
         await message.edit(f"ReplyRaid was not active for {target_user.first_name}.", parse_mode=enums.ParseMode.HTML)
 
-@Client.on_message(filters.incoming & ~filters.me)
+@Client.on_message(user_in(que) & filters.incoming & ~filters.me)
 async def replyraid_watcher(client: Client, message: Message):
     """Watches for messages from targeted users and replies."""
     if message.from_user and que.get(message.from_user.id):
-        username = f"[{target_user.first_name}](tg://user?id={target_user.id})"
+        username = f"[{message.from_user.first_name}](tg://user?id={message.from_user.id})"
         reply_text = random.choice(REPLYRAID)
         caption=f"{username} {reply_text}"
         await message.reply_text(caption)
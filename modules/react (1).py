@@ -8,10 +8,14 @@ from pyrogram.errors import UserNotParticipant, FloodWait
 # A fallback is provided for standalone testing.
 try:
     from utils.misc import modules_help, prefix
+    from utils.prefilter import chat_in
 except ImportError:
     modules_help = {}
     prefix = "."
 
+    def chat_in(chats):
+        return filters.all
+
 # A dictionary to store chat IDs and their corresponding list of emojis
 # Format: {chat_id: [emoji1, emoji2, ...]}
 ACTIVE_CHATS = {}
@@ -49,7 +53,7 @@ async def manage_autoreact(client: Client, message: Message):
         )
 
 
-@Client.on_message(filters.all & ~filters.me, group=1)
+@Client.on_message(chat_in(ACTIVE_CHATS) & ~filters.me, group=1)
 async def auto_reactor(client: Client, message: Message):
     """The main handler that reacts to new messages with a random emoji."""
     # Check if the current chat is in our active list
@@ -0,0 +1,146 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import html
+import json
+import time
+from io import BytesIO
+
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from utils import metrics
+from utils.misc import modules_help, prefix
+from utils.scripts import import_times
+from utils.watchdog import watchdog
+from utils.workqueue import queues
+
+SORT_KEYS = {
+    "time": "call_time",
+    "avg": "call_avg",
+    "max": "call_max",
+    "calls": "calls",
+    "filter": "check_time",
+    "errors": "errors",
+    "continue": "continue_rate",
+}
+
+
+def ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}"
+
+
+@Client.on_message(filters.command("stats", prefix) & filters.me)
+async def stats(client: Client, message: Message):
+    arg = message.command[1].lower() if len(message.command) > 1 else "time"
+
+    if arg == "reset":
+        metrics.reset()
+        return await message.edit("<b>Handler stats were reset</b>")
+
+    if arg == "json":
+        document = BytesIO(json.dumps(metrics.snapshot(), indent=2).encode())
+        document.name = "stats.json"
+        await message.delete()
+        return await client.send_document(message.chat.id, document)
+
+    if arg == "queues":
+        text = "<b>Background work queues:</b>\n"
+        for name, queue in queues.items():
+            item = queue.stats()
+            text += (
+                f"<b>{name}</b>\n"
+                f"<code>running {item['running']}, pending {item['pending']} "
+                f"in {item['chats']} chats, submitted {item['submitted']}, "
+                f"dropped {item['dropped']}, merged {item['merged']}, "
+                f"failed {item['failed']}</code>\n"
+            )
+        return await message.edit(text)
+
+    if arg == "imports":
+        slowest = sorted(import_times.items(), key=lambda item: -item[1])
+        text = f"<b>Module import times at startup ({len(slowest)} modules):</b>\n"
+        for name, seconds in slowest[:15]:
+            text += f"<code>{name}: {ms(seconds)}ms</code>\n"
+        return await message.edit(text)
+
+    if arg not in SORT_KEYS:
+        return await message.edit(
+            f"<b>Unknown sort key, use one of:</b> <code>{', '.join(SORT_KEYS)}</code>"
+        )
+
+    handlers = metrics.top(SORT_KEYS[arg])
+    uptime = int(time.time() - metrics.snapshot()["since"])
+    text = f"<b>Handler stats for the last {uptime}s, by {arg}:</b>\n\n"
+    for item in handlers:
+        text += (
+            f"<b>{item['module']}.{item['handler']}</b>\n"
+            f"<code>calls {item['calls']}, "
+            f"total {ms(item['call_time'])}ms, "
+            f"avg {ms(item['call_avg'])}ms, "
+            f"max {ms(item['call_max'])}ms\n"
+            f"filter {item['checks']}x {ms(item['check_time'])}ms, "
+            f"errors {item['errors']}, "
+            f"continued {item['continue_rate']:.0%}</code>\n"
+        )
+    await message.edit(text)
+
+
+@Client.on_message(filters.command("lag", prefix) & filters.me)
+async def lag(_, message: Message):
+    if len(message.command) > 1 and message.command[1].lower() == "reset":
+        watchdog.reset()
+        return await message.edit("<b>Event loop stats were reset</b>")
+
+    current = watchdog.lag()
+    text = (
+        "<b>Event loop lag (last minute):</b>\n"
+        f"<code>now {ms(current['current'])}ms, "
+        f"avg {ms(current['avg'])}ms, "
+        f"p99 {ms(current['p99'])}ms, "
+        f"max {ms(current['max'])}ms</code>\n\n"
+        f"<b>Blocked longer than {watchdog.threshold}s, by module:</b>\n"
+    )
+    modules = sorted(watchdog.modules.items(), key=lambda item: -item[1][1])
+    for module, (count, total, longest) in modules[:10]:
+        text += (
+            f"<code>{module}: {count}x, total {total:.2f}s, "
+            f"longest {longest:.2f}s</code>\n"
+        )
+    if not modules:
+        text += "<i>Nothing so far</i>\n"
+
+    if watchdog.stalls:
+        stall = watchdog.stalls[-1]
+        ago = int(time.time() - stall.started)
+        text += (
+            f"\n<b>Last one, {ago}s ago in {stall.module} "
+            f"({stall.duration:.2f}s):</b>\n"
+            f"<pre>{html.escape(stall.format_stack(3))}</pre>"
+        )
+    await message.edit(text)
+
+
+modules_help["stats"] = {
+    "stats [time|avg|max|calls|filter|errors|continue]": "Show the slowest handlers,"
+    " sorted by total handler time by default",
+    "stats json": "Send handler stats as a JSON file",
+    "stats queues": "Show background work queues of passive handlers",
+    "stats imports": "Show the slowest module imports at startup",
+    "stats reset": "Reset handler stats",
+    "lag": "Show event loop lag and the modules that blocked the loop",
+    "lag reset": "Reset event loop stats",
+}
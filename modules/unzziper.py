@@ -9,6 +9,7 @@ from pyrogram import Client, filters
 from pyrogram.types import Message
 from pyrogram.errors import UserIsBlocked, PeerIdInvalid
 
+from utils.editor import edits
 from utils.misc import modules_help, prefix
 from utils.scripts import format_exc
 
@@ -23,7 +24,8 @@ async def progress_callback(current, total, message, status):
             f"<b>{status}</b>\n"
             f"<code>{progress_bar} {percentage:.2f}%</code>"
         )
-        await message.edit_text(status_text)
+        # Coalesced and rate limited, upload chunks come much faster
+        edits.update(message, status_text)
     except Exception:
         pass
 
@@ -103,10 +105,11 @@ async def compress_files(client: Client, message: Message, compression_format: s
             caption=f"<b>Archive Complete!</b>\n<code>{os.path.basename(archive_path)}</code>",
             progress=progress_callback, progress_args=(status_msg, f"Uploading...")
         )
+        edits.cancel(status_msg)
         await status_msg.delete()
 
     except Exception as e:
-        await status_msg.edit_text(f"<b>An error occurred:</b>\n<code>{format_exc(e)}</code>")
+        await edits.final(status_msg, f"<b>An error occurred:</b>\n<code>{format_exc(e)}</code>")
     finally:
         if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
 
@@ -183,10 +186,11 @@ async def unzip_files_command(client: Client, message: Message):
             )
             await asyncio.sleep(1)
         
+        edits.cancel(status_msg)
         await status_msg.delete()
         
     except Exception as e:
-        await status_msg.edit_text(f"<b>An error occurred:</b>\n<code>{format_exc(e)}</code>")
+        await edits.final(status_msg, f"<b>An error occurred:</b>\n<code>{format_exc(e)}</code>")
     finally:
         if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
 
@@ -24,7 +24,7 @@ from pyrogram.types import Message
 
 from utils.misc import modules_help, prefix, requirements_list
 from utils.db import db
-from utils.scripts import format_exc, restart
+from utils.scripts import RESTART_INFO_TTL, format_exc, restart
 
 
 def check_command(command):
@@ -41,10 +41,13 @@ async def restart_cmd(_, message: Message):
             "chat_id": message.chat.id,
             "message_id": message.id,
         },
+        ttl=RESTART_INFO_TTL,
     )
 
     if "LAVHOST" in os.environ:
         await message.edit("<b>Your lavHost is restarting...</b>")
+        # lavhost stops this process, write restart_info out before that
+        db.flush()
         os.system("lavhost restart")
         return
 
@@ -64,10 +67,12 @@ async def update(_, message: Message):
             "chat_id": message.chat.id,
             "message_id": message.id,
         },
+        ttl=RESTART_INFO_TTL,
     )
 
     if "LAVHOST" in os.environ:
         await message.edit("<b>Your lavHost is updating...</b>")
+        db.flush()
         os.system("lavhost update")
         return
 
@@ -10,13 +10,18 @@ except FileNotFoundError:
 api_id = int(os.getenv("API_ID", env.int("API_ID")))
 api_hash = os.getenv("API_HASH", env.str("API_HASH"))
 
-SESSION_STRINGS = environs.get("SESSION_STRING", "").split()
+SESSION_STRINGS = env.str("SESSION_STRING", "").split()
+STRINGSESSION = os.getenv("STRINGSESSION", env.str("STRINGSESSION", ""))
 
 second_session = os.getenv("SECOND_SESSION", env.str("SECOND_SESSION", ""))
 
 db_type = os.getenv("DATABASE_TYPE", env.str("DATABASE_TYPE"))
 db_url = os.getenv("DATABASE_URL", env.str("DATABASE_URL", ""))
 db_name = os.getenv("DATABASE_NAME", env.str("DATABASE_NAME"))
+db_pool_size = int(os.getenv("DATABASE_POOL_SIZE", env.int("DATABASE_POOL_SIZE", 10)))
+db_min_pool_size = int(
+    os.getenv("DATABASE_MIN_POOL_SIZE", env.int("DATABASE_MIN_POOL_SIZE", 1))
+)
 
 apiflash_key = os.getenv("APIFLASH_KEY", env.str("APIFLASH_KEY"))
 rmbg_key = os.getenv("RMBG_KEY", env.str("RMBG_KEY", ""))
@@ -25,8 +30,12 @@ gemini_key = os.getenv("GEMINI_KEY", env.str("GEMINI_KEY", ""))
 cohere_key = os.getenv("COHERE_KEY", env.str("COHERE_KEY", ""))
 
 pm_limit = int(os.getenv("PM_LIMIT", env.int("PM_LIMIT", 4)))
+chat_history_limit = int(
+    os.getenv("CHAT_HISTORY_LIMIT", env.int("CHAT_HISTORY_LIMIT", 100))
+)
 
 test_server = bool(os.getenv("TEST_SERVER", env.bool("TEST_SERVER", False)))
+lazy_modules = env.bool("LAZY_MODULES", False)
 modules_repo_branch = os.getenv(
     "MODULES_REPO_BRANCH", env.str("MODULES_REPO_BRANCH", "master")
 )
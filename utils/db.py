@@ -14,25 +14,66 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
 import re
 import json
+import time
+import pickle
+import asyncio
+import logging
 import threading
 import sqlite3
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
 from dns import resolver
 import pymongo
 from utils import config
+from utils.profiler import profiler
 
 resolver.default_resolver = resolver.Resolver(configure=False)
 resolver.default_resolver.nameservers = ["1.1.1.1"]
 
 
+# Marks a variable that is known to be absent from the database
+_ABSENT = object()
+
+# Value passed to subscribers when a variable is removed or expires
+REMOVED = _ABSENT
+
+# Raised for names and values that no retry can write: bad module names,
+# types the codec rejects
+_UNWRITABLE = (TypeError, ValueError)
+
+
 class Database:
+    # Executor that runs blocking database calls for the async API
+    _executor: ThreadPoolExecutor = None
+
+    def validate(self, module: str, variable: str = None):
+        """Check module and variable names before they reach the database"""
+        if not isinstance(module, str):
+            raise ValueError("Module must be a string")
+        if variable is not None and not isinstance(variable, str):
+            raise ValueError("Module and variable must be strings")
+
+    def _fetch(self, module: str, variables: list = None, prefix: str = None):
+        """
+        Get ``{variable: (value, expires)}`` for live variables of a module,
+        optionally limited to the given variables or to a name prefix.
+        ``expires`` is a unix timestamp or None for keys without TTL.
+        """
+        raise NotImplementedError
+
     def get(self, module: str, variable: str, default=None):
         """Get value from database"""
-        raise NotImplementedError
+        self.validate(module, variable)
+        entry = self._fetch(module, [variable]).get(variable)
+        return default if entry is None else entry[0]
 
-    def set(self, module: str, variable: str, value):
-        """Set key in database"""
+    def set(self, module: str, variable: str, value, ttl: float = None):
+        """Set key in database, it expires after ``ttl`` seconds if given"""
         raise NotImplementedError
 
     def remove(self, module: str, variable: str):
@@ -41,53 +82,129 @@ class Database:
 
     def get_collection(self, module: str) -> dict:
         """Get database for selected module"""
-        raise NotImplementedError
+        self.validate(module)
+        return {var: val for var, (val, _) in self._fetch(module).items()}
+
+    def get_many(self, module: str, variables) -> dict:
+        """Get several variables of a module, missing ones are left out"""
+        variables = list(variables)
+        for variable in variables:
+            self.validate(module, variable)
+        return {var: val for var, (val, _) in self._fetch(module, variables).items()}
+
+    def scan(self, module: str, prefix: str) -> dict:
+        """Get all variables of a module whose name starts with prefix"""
+        self.validate(module)
+        return {
+            var: val for var, (val, _) in self._fetch(module, prefix=prefix).items()
+        }
+
+    def sweep(self):
+        """Delete expired keys"""
+
+    def watch(self, callback) -> bool:
+        """
+        Report changes made by other clients of the database as
+        ``callback(module, variable, value)``. Returns False when the
+        database can't report them.
+        """
+        return False
 
     def close(self):
         """Close the database"""
         raise NotImplementedError
 
+    @contextmanager
+    def transaction(self):
+        """Group writes made inside the block into a single commit"""
+        yield self
 
-class MongoDatabase(Database):
-    def __init__(self, url, name):
-        self._client = pymongo.MongoClient(url)
-        self._database = self._client[name]
+    def set_many(self, module: str, values: dict, ttl: float = None):
+        """Set several keys of a module in one go"""
+        with self.transaction():
+            for variable, value in values.items():
+                self.set(module, variable, value, ttl)
 
-    def set(self, module: str, variable: str, value):
-        if not isinstance(module, str) or not isinstance(variable, str):
-            raise ValueError("Module and variable must be strings")
-        self._database[module].replace_one(
-            {"var": variable}, {"var": variable, "val": value}, upsert=True
+    def apply(self, changes: dict):
+        """
+        Write ``{(module, variable): (value, ttl)}`` in one batch, ``REMOVED``
+        as value removes the variable. Values that can't be stored at all are
+        logged and skipped, any other error aborts the batch and is raised,
+        so the caller can write it again.
+        """
+        with self.transaction():
+            for (module, variable), (value, ttl) in changes.items():
+                try:
+                    if value is REMOVED:
+                        self.remove(module, variable)
+                    else:
+                        self.set(module, variable, value, ttl)
+                except _UNWRITABLE:
+                    logging.exception(
+                        "Failed to write %s.%s to database", module, variable
+                    )
+
+    def run_sync(self, func, *args, **kwargs):
+        """Run blocking database call in the database executor and wait for it"""
+        if self._executor is None:
+            return func(*args, **kwargs)
+        return self._executor.submit(func, *args, **kwargs).result()
+
+    async def run_async(self, func, *args, **kwargs):
+        """Run blocking database call in the database executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
         )
 
-    def get(self, module: str, variable: str, default=None):
-        if not isinstance(module, str) or not isinstance(variable, str):
-            raise ValueError("Module and variable must be strings")
-        doc = self._database[module].find_one({"var": variable})
-        return default if doc is None else doc["val"]
+    async def aget(self, module: str, variable: str, default=None):
+        """Get value from database without blocking the event loop"""
+        return await self.run_async(self.get, module, variable, default)
 
-    def get_collection(self, module: str):
-        if not isinstance(module, str):
-            raise ValueError("Module must be a string")
-        return {item["var"]: item["val"] for item in self._database[module].find()}
+    async def aset(self, module: str, variable: str, value, ttl: float = None):
+        """Set key in database without blocking the event loop"""
+        return await self.run_async(self.set, module, variable, value, ttl)
 
-    def remove(self, module: str, variable: str):
-        if not isinstance(module, str) or not isinstance(variable, str):
-            raise ValueError("Module and variable must be strings")
-        self._database[module].delete_one({"var": variable})
+    async def aremove(self, module: str, variable: str):
+        """Remove key from database without blocking the event loop"""
+        return await self.run_async(self.remove, module, variable)
 
-    def close(self):
-        self._client.close()
+    async def aget_collection(self, module: str) -> dict:
+        """Get database for selected module without blocking the event loop"""
+        return await self.run_async(self.get_collection, module)
+
+    async def aset_many(self, module: str, values: dict, ttl: float = None):
+        """Set several keys of a module without blocking the event loop"""
+        return await self.run_async(self.set_many, module, values, ttl)
+
+    async def aget_many(self, module: str, variables) -> dict:
+        """Get several variables of a module without blocking the event loop"""
+        return await self.run_async(self.get_many, module, list(variables))
+
+    async def ascan(self, module: str, prefix: str) -> dict:
+        """Get variables by name prefix without blocking the event loop"""
+        return await self.run_async(self.scan, module, prefix)
 
     def add_chat_history(self, user_id, message):
-        chat_history = self.get_chat_history(user_id, default=[])
-        chat_history.append(message)
-        self.set(f"core.cohere.user_{user_id}", "chat_history", chat_history)
+        """Append message to user's chat history"""
+        raise NotImplementedError
+
+    def get_chat_history(self, user_id, default=None, limit=None):
+        """Get last ``limit`` messages (``config.chat_history_limit`` by default)"""
+        raise NotImplementedError
+
+    def clear_chat_history(self, user_id):
+        """Remove all messages from user's chat history"""
+        raise NotImplementedError
+
+    async def aadd_chat_history(self, user_id, message):
+        return await self.run_async(self.add_chat_history, user_id, message)
 
-    def get_chat_history(self, user_id, default=None):
-        if default is None:
-            default = []
-        return self.get(f"core.cohere.user_{user_id}", "chat_history", default=[])
+    async def aget_chat_history(self, user_id, default=None, limit=None):
+        return await self.run_async(self.get_chat_history, user_id, default, limit)
+
+    async def aclear_chat_history(self, user_id):
+        return await self.run_async(self.clear_chat_history, user_id)
 
     def addaiuser(self, user_id):
         chatai_users = self.get("core.chatbot", "chatai_users", default=[])
@@ -105,65 +222,483 @@ class MongoDatabase(Database):
         return self.get("core.chatbot", "chatai_users", default=[])
 
 
+class MongoDatabase(Database):
+    # Only these fields are read back, _id is never needed
+    projection = {"_id": 0, "var": 1, "val": 1, "expires": 1}
+
+    def __init__(self, url, name, pool_size=10, min_pool_size=1):
+        # minPoolSize keeps a warm connection, so a request after an idle
+        # period doesn't pay for the TLS handshake with a hosted server
+        self._client = pymongo.MongoClient(
+            url, maxPoolSize=pool_size, minPoolSize=min_pool_size
+        )
+        self._database = self._client[name]
+        # pymongo is thread-safe, so requests can run concurrently,
+        # one worker per pooled connection
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="mongodb"
+        )
+        self._indexed = set()
+        self._ttl_indexed = set()
+        self._change_stream = None
+        self._history = self._database["chat_history"]
+        # MongoClient connects lazily, keep it that way: nothing here may wait
+        # for the server, indexes are made on first use of a collection
+        self._history_ready = threading.Event()
+        threading.Thread(
+            target=self._prepare_history, name="db-migrate", daemon=True
+        ).start()
+
+    def _prepare_history(self):
+        try:
+            self._history.create_index(
+                [("user_id", pymongo.ASCENDING), ("seq", pymongo.ASCENDING)],
+                unique=True,
+            )
+            self._migrate_chat_history()
+        except pymongo.errors.PyMongoError:
+            logging.exception("Failed to prepare chat history")
+        finally:
+            self._history_ready.set()
+
+    def _ensure_index(self, module: str):
+        # Every lookup, upsert and prefix scan goes by var
+        if module in self._indexed:
+            return
+        try:
+            self._database[module].create_index("var", unique=True)
+        except pymongo.errors.OperationFailure:
+            # Old upserts without an index could race into duplicates
+            logging.warning("Duplicate variables in %s, var index isn't unique", module)
+            self._database[module].create_index("var")
+        self._indexed.add(module)
+
+    def _document(self, module: str, variable: str, value, ttl: float = None):
+        self.validate(module, variable)
+        self._ensure_index(module)
+        doc = {"var": variable, "val": value}
+        if ttl is not None:
+            self._ensure_ttl_index(module)
+            doc["expires"] = datetime.fromtimestamp(time.time() + ttl, timezone.utc)
+        return doc
+
+    def set(self, module: str, variable: str, value, ttl: float = None):
+        doc = self._document(module, variable, value, ttl)
+        self._database[module].replace_one({"var": variable}, doc, upsert=True)
+
+    def set_many(self, module: str, values: dict, ttl: float = None):
+        self.apply({(module, var): (value, ttl) for var, value in values.items()})
+
+    def apply(self, changes: dict):
+        # One bulk_write round-trip per module instead of one per change
+        # Replace and delete are idempotent, so a batch that failed half way
+        # through is raised and can simply be written again
+        requests = {}
+        for (module, variable), (value, ttl) in changes.items():
+            try:
+                if value is REMOVED:
+                    self.validate(module, variable)
+                    request = pymongo.DeleteOne({"var": variable})
+                else:
+                    doc = self._document(module, variable, value, ttl)
+                    request = pymongo.ReplaceOne({"var": variable}, doc, upsert=True)
+            except _UNWRITABLE:
+                logging.exception("Failed to write %s.%s to database", module, variable)
+                continue
+            requests.setdefault(module, []).append((variable, request))
+
+        for module, batch in requests.items():
+            collection = self._database[module]
+            try:
+                collection.bulk_write([request for _, request in batch], ordered=False)
+            except pymongo.errors.InvalidDocument:
+                # One value BSON can't encode fails the whole batch, write them
+                # one by one to drop only that one
+                for variable, request in batch:
+                    try:
+                        collection.bulk_write([request])
+                    except pymongo.errors.InvalidDocument:
+                        logging.exception(
+                            "Failed to write %s.%s to database", module, variable
+                        )
+
+    def _ensure_ttl_index(self, module: str):
+        # MongoDB deletes expired documents by itself (about once a minute),
+        # reads skip the ones that are already expired but not deleted yet
+        if module not in self._ttl_indexed:
+            self._database[module].create_index("expires", expireAfterSeconds=0)
+            self._ttl_indexed.add(module)
+
+    def _fetch(self, module: str, variables: list = None, prefix: str = None):
+        self._ensure_index(module)
+        query = {}
+        if variables is not None:
+            query["var"] = {"$in": variables}
+        elif prefix:
+            # An anchored regex is answered from the index on var
+            query["var"] = {"$regex": f"^{re.escape(prefix)}"}
+
+        now = time.time()
+        entries = {}
+        for item in self._database[module].find(query, self.projection):
+            expires = item.get("expires")
+            if expires is not None:
+                expires = expires.replace(tzinfo=timezone.utc).timestamp()
+                if expires <= now:
+                    continue
+            entries[item["var"]] = (item["val"], expires)
+        return entries
+
+    def remove(self, module: str, variable: str):
+        self.validate(module, variable)
+        self._database[module].delete_one({"var": variable})
+
+    def add_chat_history(self, user_id, message):
+        self._history_ready.wait()
+        while True:
+            last = self._history.find_one(
+                {"user_id": user_id}, {"seq": 1}, sort=[("seq", pymongo.DESCENDING)]
+            )
+            seq = last["seq"] + 1 if last else 1
+            try:
+                self._history.insert_one(
+                    {"user_id": user_id, "seq": seq, "message": message}
+                )
+            except pymongo.errors.DuplicateKeyError:
+                # Another writer took this sequence number, try the next one
+                continue
+            break
+        if config.chat_history_limit:
+            self._history.delete_many(
+                {"user_id": user_id, "seq": {"$lte": seq - config.chat_history_limit}}
+            )
+
+    def get_chat_history(self, user_id, default=None, limit=None):
+        self._history_ready.wait()
+        cursor = self._history.find(
+            {"user_id": user_id},
+            {"message": 1},
+            sort=[("seq", pymongo.DESCENDING)],
+            limit=limit or config.chat_history_limit,
+        )
+        history = [doc["message"] for doc in cursor][::-1]
+        if not history:
+            return [] if default is None else default
+        return history
+
+    def clear_chat_history(self, user_id):
+        self._history_ready.wait()
+        self._history.delete_many({"user_id": user_id})
+
+    def _migrate_chat_history(self):
+        # Chat history used to be a single list in core.cohere.user_{id}
+        for name in self._database.list_collection_names(
+            filter={"name": {"$regex": r"^core\.cohere\.user_"}}
+        ):
+            user_id = int(name.rsplit("_", 1)[1])
+            doc = self._database[name].find_one({"var": "chat_history"})
+            messages = doc["val"] if doc else []
+            if messages:
+                try:
+                    self._history.insert_many(
+                        (
+                            {"user_id": user_id, "seq": seq, "message": message}
+                            for seq, message in enumerate(messages, start=1)
+                        ),
+                        ordered=False,
+                    )
+                except pymongo.errors.BulkWriteError as e:
+                    # Rows left by an interrupted run, like INSERT OR IGNORE
+                    if any(
+                        error["code"] != 11000 for error in e.details["writeErrors"]
+                    ):
+                        raise
+            self._database.drop_collection(name)
+
+    def watch(self, callback) -> bool:
+        # Opening the stream talks to the server, so it's done by the thread
+        threading.Thread(
+            target=self._watch_loop, args=(callback,), name="db-watcher", daemon=True
+        ).start()
+        return True
+
+    def _watch_loop(self, callback):
+        try:
+            self._change_stream = self._database.watch(full_document="updateLookup")
+        except pymongo.errors.OperationFailure:
+            # Change streams need a replica set, a standalone server has none
+            logging.info("Database can't report changes of other clients")
+            return
+        except pymongo.errors.PyMongoError:
+            logging.exception("Failed to open database change stream")
+            return
+        try:
+            for change in self._change_stream:
+                module = change["ns"]["coll"]
+                if not module.startswith(("core", "custom")):
+                    continue
+                document = change.get("fullDocument")
+                if document is not None:
+                    callback(module, document["var"], document["val"])
+                else:
+                    # Deletes only carry _id, so the variable is unknown
+                    callback(module, None, REMOVED)
+        except pymongo.errors.PyMongoError:
+            if self._change_stream.alive:
+                logging.exception("Database change stream failed")
+
+    def close(self):
+        if self._change_stream is not None:
+            self._change_stream.close()
+        self._executor.shutdown()
+        self._client.close()
+
+
+class JsonCodec:
+    """Values as JSON text, the format used before PickleCodec"""
+
+    name = "json"
+
+    @staticmethod
+    def dumps(value):
+        return json.dumps(value)
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+
+# Types that may be stored, everything else is rejected like json.dumps does
+_PICKLE_TYPES = {
+    t.__name__: t
+    for t in (bool, int, float, complex, str, bytes, list, tuple, dict, set, frozenset)
+}
+
+
+class _ValuePickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        # Most exact builtin types are pickled before this is asked, but not
+        # all of them (complex is), leave those and the type objects to pickle
+        if _PICKLE_TYPES.get(type(obj).__name__) is type(obj):
+            return NotImplemented
+        if _PICKLE_TYPES.get(getattr(obj, "__name__", None)) is obj:
+            return NotImplemented
+        for typ in type(obj).__mro__:
+            if _PICKLE_TYPES.get(typ.__name__) is typ:
+                # str() of a str enum is its name, not its value
+                return typ, (str.__str__(obj) if typ is str else typ(obj),)
+        raise TypeError(f"Object of type {type(obj).__name__} can't be stored")
+
+
+class _ValueUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == "builtins" and name in _PICKLE_TYPES:
+            return _PICKLE_TYPES[name]
+        raise pickle.UnpicklingError(f"Global {module}.{name} is forbidden")
+
+
+class PickleCodec:
+    """
+    Values as pickle protocol 5 restricted to builtin types.
+
+    Decoding is about twice as fast as json.loads, and tuples, sets and
+    non-string dict keys survive the round trip.
+    """
+
+    name = "pickle"
+
+    @staticmethod
+    def dumps(value):
+        buffer = io.BytesIO()
+        _ValuePickler(buffer, protocol=5).dump(value)
+        return buffer.getvalue()
+
+    @staticmethod
+    def loads(data):
+        return _ValueUnpickler(io.BytesIO(data)).load()
+
+
 class SqliteDatabase(Database):
-    def __init__(self, file):
-        self._conn = sqlite3.connect(file, check_same_thread=False)
+    # Codecs that can read values of the "type" they are named after
+    codecs = {codec.name: codec for codec in (JsonCodec, PickleCodec)}
+
+    module_name = re.compile(r"^(core|custom)")
+
+    # Statement templates, formatted once per table and operation
+    _ALIVE = "(expires IS NULL OR expires > ?)"
+    statements = {
+        "get": f"SELECT * FROM '{{table}}' WHERE var=? AND {_ALIVE}",
+        "get_many": f"SELECT * FROM '{{table}}' WHERE var IN ({{params}}) AND {_ALIVE}",
+        "scan": f"SELECT * FROM '{{table}}' WHERE var >= ? AND var < ? AND {_ALIVE}",
+        "all": f"SELECT * FROM '{{table}}' WHERE {_ALIVE}",
+        "set": """
+        INSERT INTO '{table}' (var, val, type, expires) VALUES ( ?, ?, ?, ? )
+        ON CONFLICT (var) DO
+        UPDATE SET val=excluded.val, type=excluded.type, expires=excluded.expires
+        """,
+        "remove": "DELETE FROM '{table}' WHERE var=?",
+        "sweep": "DELETE FROM '{table}' WHERE expires <= ?",
+    }
+
+    def __init__(self, file, codec=PickleCodec):
+        self._codec = codec
+        # sqlite3 keeps prepared statements in an LRU keyed by SQL text, make
+        # it large enough for every (table, operation) we format
+        self._conn = sqlite3.connect(
+            file, check_same_thread=False, cached_statements=512
+        )
         self._conn.row_factory = sqlite3.Row
+        # WAL lets readers run alongside the writer, and with synchronous=NORMAL
+        # a commit no longer waits for fsync (only checkpoints do)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA cache_size=-16000")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
         self._cursor = self._conn.cursor()
-        self._lock = threading.Lock()
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        # Single writer thread, so SQL never runs on the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_history (
+            user_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            PRIMARY KEY (user_id, seq)
+            ) WITHOUT ROWID
+            """)
+        self._migrate_tables()
+        self._migrate_chat_history()
+        self._conn.commit()
+        self._statements = {}
+        self._load_tables()
 
-    @staticmethod
-    def _parse_row(row: sqlite3.Row):
+    def _parse_row(self, row: sqlite3.Row):
         if row["type"] == "bool":
             return row["val"] == "1"
         if row["type"] == "int":
             return int(row["val"])
         if row["type"] == "str":
             return row["val"]
-        return json.loads(row["val"])
+        return self.codecs[row["type"]].loads(row["val"])
 
-    def _execute(self, module: str, *args, **kwargs) -> sqlite3.Cursor:
-        pattern = r"^(core|custom)"
-        if not re.match(pattern, module):
-            raise ValueError(f"Invalid module name format: {module}")
+    def _create_table(self, module: str):
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS '{module}' (
+            var TEXT UNIQUE NOT NULL,
+            val BLOB NOT NULL,
+            type TEXT NOT NULL,
+            expires REAL
+            )
+            """)
+        self._create_expires_index(module)
+
+    def _create_expires_index(self, module: str):
+        # Partial index, so only keys with TTL pay for it
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS '{module}.expires' "
+            f"ON '{module}' (expires) WHERE expires IS NOT NULL"
+        )
 
-        self._lock.acquire()
+    def _module_tables(self) -> list:
+        return [
+            row["name"]
+            for row in self._conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' "
+                "AND (name GLOB 'core*' OR name GLOB 'custom*')"
+            )
+        ]
+
+    def _migrate_tables(self):
+        # Tables created before keys could expire don't have the expires column
+        for module in self._module_tables():
+            columns = [
+                row["name"]
+                for row in self._conn.execute(f"PRAGMA table_info('{module}')")
+            ]
+            if "expires" not in columns:
+                self._conn.execute(f"ALTER TABLE '{module}' ADD COLUMN expires REAL")
+                self._create_expires_index(module)
+
+            # Re-encode values written by another codec, so reads don't
+            # fall back to the slower one forever
+            others = [name for name in self.codecs if name != self._codec.name]
+            rows = self._conn.execute(
+                f"SELECT var, val, type FROM '{module}' "
+                f"WHERE type IN ({', '.join('?' * len(others))})",
+                others,
+            ).fetchall()
+            self._conn.executemany(
+                f"UPDATE '{module}' SET val=?, type=? WHERE var=?",
+                [
+                    (
+                        self._codec.dumps(self._parse_row(row)),
+                        self._codec.name,
+                        row["var"],
+                    )
+                    for row in rows
+                ],
+            )
+
+    def _load_tables(self):
+        """Sync the registry of existing tables with the database file"""
+        self._tables = set(self._module_tables())
+        self._statements = {
+            key: sql for key, sql in self._statements.items() if key[0] in self._tables
+        }
+
+    def _statement(self, module: str, op: str, params: int = 0) -> str:
+        """Get SQL of an operation on a module table, creating the table once"""
         try:
-            cursor = self._conn.cursor()
-            return cursor.execute(*args, **kwargs)
-        except sqlite3.OperationalError as e:
-            if str(e).startswith("no such table"):
-                sql = f"""
-                CREATE TABLE IF NOT EXISTS '{module}' (
-                var TEXT UNIQUE NOT NULL,
-                val TEXT NOT NULL,
-                type TEXT NOT NULL
-                )
-                """
-                cursor = self._conn.cursor()
-                cursor.execute(sql)
-                self._conn.commit()
-                return cursor.execute(*args, **kwargs)
-            raise e from None
-        finally:
-            self._lock.release()
+            return self._statements[module, op, params]
+        except KeyError:
+            pass
 
-    def get(self, module: str, variable: str, default=None):
-        sql = f"SELECT * FROM '{module}' WHERE var=?"
-        cur = self._execute(module, sql, (variable,))
+        if not self.module_name.match(module):
+            raise ValueError(f"Invalid module name format: {module}")
+        with self._lock:
+            if module not in self._tables:
+                self._create_table(module)
+                self._commit()
+                self._tables.add(module)
+            sql = self.statements[op].format(
+                table=module, params=", ".join("?" * params)
+            )
+            self._statements[module, op, params] = sql
+        return sql
 
-        row = cur.fetchone()
-        if row is None:
-            return default
-        return self._parse_row(row)
+    def _execute(self, module: str, op: str, args=(), params: int = 0):
+        sql = self._statement(module, op, params)
+        with self._lock:
+            return self._conn.execute(sql, args)
 
-    def set(self, module: str, variable: str, value) -> bool:
-        sql = f"""
-        INSERT INTO '{module}' VALUES ( ?, ?, ? )
-        ON CONFLICT (var) DO
-        UPDATE SET val=?, type=? WHERE var=?
-        """
+    def _fetch(self, module: str, variables: list = None, prefix: str = None):
+        now = time.time()
+        with self._lock:
+            if variables is not None and len(variables) == 1:
+                rows = self._execute(module, "get", (variables[0], now)).fetchall()
+            elif variables is not None:
+                rows = []
+                # Stay below SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds
+                for i in range(0, len(variables), 500):
+                    chunk = variables[i : i + 500]
+                    rows += self._execute(
+                        module, "get_many", (*chunk, now), len(chunk)
+                    ).fetchall()
+            elif prefix and prefix[-1] != chr(0x10FFFF):
+                # A range over the unique index on var instead of LIKE, which
+                # can't use the index (and would need escaping of % and _)
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                rows = self._execute(module, "scan", (prefix, upper, now)).fetchall()
+            else:
+                rows = [
+                    row
+                    for row in self._execute(module, "all", (now,))
+                    if row["var"].startswith(prefix or "")
+                ]
+        return {row["var"]: (self._parse_row(row), row["expires"]) for row in rows}
 
+    def set(self, module: str, variable: str, value, ttl: float = None) -> bool:
         if isinstance(value, bool):
             val = "1" if value else "0"
             typ = "bool"
@@ -174,64 +709,510 @@ class SqliteDatabase(Database):
             val = str(value)
             typ = "int"
         else:
-            val = json.dumps(value)
-            typ = "json"
+            val = self._codec.dumps(value)
+            typ = self._codec.name
+        expires = None if ttl is None else time.time() + ttl
 
-        self._execute(module, sql, (variable, val, typ, val, typ, variable))
-        self._conn.commit()
+        with self._lock:
+            self._execute(module, "set", (variable, val, typ, expires))
+            self._commit()
 
         return True
 
     def remove(self, module: str, variable: str):
-        sql = f"DELETE FROM '{module}' WHERE var=?"
-        self._execute(module, sql, (variable,))
-        self._conn.commit()
+        with self._lock:
+            self._execute(module, "remove", (variable,))
+            self._commit()
 
-    def get_collection(self, module: str) -> dict:
-        pattern = r"^(core|custom)"
-        if not re.match(pattern, module):
+    def sweep(self):
+        now = time.time()
+        with self.transaction():
+            for module in list(self._tables):
+                self._execute(module, "sweep", (now,))
+
+    def _commit(self):
+        # Writes inside transaction() are committed when the outermost block ends
+        if not self._transaction_depth:
+            self._conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self._transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._transaction_depth -= 1
+                if not self._transaction_depth:
+                    self._conn.rollback()
+                    # Tables created in the transaction are gone as well
+                    self._load_tables()
+                raise
+            self._transaction_depth -= 1
+            self._commit()
+
+    def validate(self, module: str, variable: str = None):
+        super().validate(module, variable)
+        if module not in self._tables and not self.module_name.match(module):
             raise ValueError(f"Invalid module name format: {module}")
 
-        sql = f"SELECT * FROM '{module}'"
-        cur = self._execute(module, sql)
+    def add_chat_history(self, user_id, message):
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT MAX(seq) FROM chat_history WHERE user_id=?", (user_id,)
+            )
+            seq = (cursor.fetchone()[0] or 0) + 1
+            self._conn.execute(
+                "INSERT INTO chat_history VALUES ( ?, ?, ? )",
+                (user_id, seq, json.dumps(message)),
+            )
+            if config.chat_history_limit:
+                self._conn.execute(
+                    "DELETE FROM chat_history WHERE user_id=? AND seq<=?",
+                    (user_id, seq - config.chat_history_limit),
+                )
+            self._commit()
+
+    def get_chat_history(self, user_id, default=None, limit=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message FROM chat_history WHERE user_id=? "
+                "ORDER BY seq DESC LIMIT ?",
+                (user_id, limit or config.chat_history_limit or -1),
+            ).fetchall()
+        if not rows:
+            return [] if default is None else default
+        return [json.loads(row["message"]) for row in reversed(rows)]
 
-        collection = {}
-        for row in cur:
-            collection[row["var"]] = self._parse_row(row)
+    def clear_chat_history(self, user_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_history WHERE user_id=?", (user_id,))
+            self._commit()
 
-        return collection
+    def _migrate_chat_history(self):
+        # Chat history used to be a single JSON list in core.cohere.user_{id}
+        tables = self._conn.execute(
+            "SELECT name FROM sqlite_master "
+            "WHERE type='table' AND name LIKE 'core.cohere.user\\_%' ESCAPE '\\'"
+        ).fetchall()
+        for (name,) in tables:
+            user_id = int(name.rsplit("_", 1)[1])
+            row = self._conn.execute(
+                f"SELECT * FROM '{name}' WHERE var='chat_history'"
+            ).fetchone()
+            messages = self._parse_row(row) if row else []
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chat_history VALUES ( ?, ?, ? )",
+                [
+                    (user_id, seq, json.dumps(message))
+                    for seq, message in enumerate(messages, start=1)
+                ],
+            )
+            self._conn.execute(f"DROP TABLE '{name}'")
 
     def close(self):
+        self._executor.shutdown()
         self._conn.commit()
         self._conn.close()
 
+
+def _clone(value):
+    """Copy containers PickleCodec stores, so callers can't mutate cached values"""
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    if isinstance(value, set):
+        # Members are hashable, so immutable enough
+        return set(value)
+    if isinstance(value, tuple):
+        # A tuple can hold lists and dicts
+        return tuple(_clone(v) for v in value)
+    return value
+
+
+class CachedDatabase(Database):
+    """
+    Write-behind cache in front of another database.
+
+    Decoded values are kept in memory per (module, variable), so repeated reads
+    never reach the backing database. Writes are applied to the cache at once
+    and flushed to the backing database by a background thread after at most
+    ``flush_delay`` seconds (or sooner when ``max_pending`` writes pile up).
+    The same thread deletes expired keys every ``sweep_interval`` seconds.
+
+    Callbacks registered with ``subscribe()`` are told about every change of
+    their module, including changes by other clients if the backing database
+    can report them.
+
+    The cache has no size limit: it only holds keys that were read or
+    written, the key-value data of a userbot is small (settings, notes,
+    filters), expired keys are swept, and chat history, the one store that
+    grows without bound, isn't cached.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        flush_delay: float = 1.0,
+        max_pending=512,
+        sweep_interval: float = 60.0,
+    ):
+        self._db = database
+        self._flush_delay = flush_delay
+        self._max_pending = max_pending
+        self._sweep_interval = sweep_interval
+        # Entries are (value, expires) tuples, value is _ABSENT for removed keys
+        self._cache = {}
+        self._loaded = set()
+        self._pending = {}
+        self._inflight = {}
+        self._holds = 0
+        self._closed = False
+        self._subscribers = {}
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="db-flusher", daemon=True
+        )
+        self._flusher.start()
+        self._db.watch(self._on_remote_change)
+
+    @property
+    def backend(self) -> Database:
+        return self._db
+
+    def validate(self, module: str, variable: str = None):
+        self._db.validate(module, variable)
+
+    def run_sync(self, func, *args, **kwargs):
+        return self._db.run_sync(func, *args, **kwargs)
+
+    async def run_async(self, func, *args, **kwargs):
+        return await self._db.run_async(func, *args, **kwargs)
+
+    def _lookup(self, module: str, variable: str):
+        """Get cached entry, or None if the variable isn't cached"""
+        key = (module, variable)
+        entry = (
+            self._pending.get(key)
+            or self._inflight.get(key)
+            or self._cache.get(module, {}).get(variable)
+        )
+        if entry is None and module in self._loaded:
+            return (_ABSENT, None)
+        return entry
+
+    @staticmethod
+    def _value(entry, now: float = None):
+        value, expires = entry
+        if expires is not None and expires <= (now or time.time()):
+            return _ABSENT
+        return value
+
+    def _store(self, module: str, entries: dict, variables=()):
+        """Cache fetched entries, variables that weren't found are cached as absent"""
+        with self._lock:
+            cached = self._cache.setdefault(module, {})
+            # Entries written while the fetch was running are newer than fetched ones
+            for var, entry in entries.items():
+                cached.setdefault(var, entry)
+            for var in variables:
+                cached.setdefault(var, (_ABSENT, None))
+
+    def _collect(self, module: str, variables) -> dict:
+        now = time.time()
+        values = {}
+        with self._lock:
+            for var in variables:
+                value = self._value(self._lookup(module, var), now)
+                if value is not _ABSENT:
+                    values[var] = _clone(value)
+        return values
+
+    def _module_view(self, module: str, prefix: str = "", extra=()) -> dict:
+        with self._lock:
+            variables = set(extra) | set(self._cache.get(module, {}))
+            for source in (self._inflight, self._pending):
+                variables.update(var for mod, var in source if mod == module)
+            return self._collect(
+                module, [var for var in variables if var.startswith(prefix)]
+            )
+
+    def _missing(self, module: str, variables) -> list:
+        with self._lock:
+            return [var for var in variables if self._lookup(module, var) is None]
+
+    def get(self, module: str, variable: str, default=None):
+        self.validate(module, variable)
+        if self._missing(module, [variable]):
+            self._store(module, self._db._fetch(module, [variable]), [variable])
+        return self._collect(module, [variable]).get(variable, default)
+
+    async def aget(self, module: str, variable: str, default=None):
+        self.validate(module, variable)
+        if self._missing(module, [variable]):
+            entries = await self._db.run_async(self._db._fetch, module, [variable])
+            self._store(module, entries, [variable])
+        return self._collect(module, [variable]).get(variable, default)
+
+    def get_many(self, module: str, variables) -> dict:
+        variables = list(variables)
+        for variable in variables:
+            self.validate(module, variable)
+        if missing := self._missing(module, variables):
+            self._store(module, self._db._fetch(module, missing), missing)
+        return self._collect(module, variables)
+
+    async def aget_many(self, module: str, variables) -> dict:
+        variables = list(variables)
+        for variable in variables:
+            self.validate(module, variable)
+        if missing := self._missing(module, variables):
+            entries = await self._db.run_async(self._db._fetch, module, missing)
+            self._store(module, entries, missing)
+        return self._collect(module, variables)
+
+    def scan(self, module: str, prefix: str) -> dict:
+        self.validate(module)
+        if module in self._loaded:
+            return self._module_view(module, prefix)
+        entries = self._db._fetch(module, prefix=prefix)
+        self._store(module, entries)
+        return self._module_view(module, prefix, entries)
+
+    async def ascan(self, module: str, prefix: str) -> dict:
+        self.validate(module)
+        if module in self._loaded:
+            return self._module_view(module, prefix)
+        entries = await self._db.run_async(self._db._fetch, module, prefix=prefix)
+        self._store(module, entries)
+        return self._module_view(module, prefix, entries)
+
+    def get_collection(self, module: str) -> dict:
+        self.validate(module)
+        if module not in self._loaded:
+            self._load_collection(module, self._db._fetch(module))
+        return self._module_view(module)
+
+    async def aget_collection(self, module: str) -> dict:
+        self.validate(module)
+        if module not in self._loaded:
+            entries = await self._db.run_async(self._db._fetch, module)
+            self._load_collection(module, entries)
+        return self._module_view(module)
+
+    def _load_collection(self, module: str, entries: dict):
+        with self._lock:
+            self._store(module, entries)
+            self._loaded.add(module)
+
+    def set(self, module: str, variable: str, value, ttl: float = None):
+        self.validate(module, variable)
+        self._write(module, variable, _clone(value), ttl)
+        return True
+
+    async def aset(self, module: str, variable: str, value, ttl: float = None):
+        # Writes only touch memory, the flusher does the blocking part
+        return self.set(module, variable, value, ttl)
+
+    async def aremove(self, module: str, variable: str):
+        self.remove(module, variable)
+
+    def remove(self, module: str, variable: str):
+        self.validate(module, variable)
+        self._write(module, variable, _ABSENT)
+
+    def set_many(self, module: str, values: dict, ttl: float = None):
+        for variable in values:
+            self.validate(module, variable)
+        with self.transaction():
+            for variable, value in values.items():
+                self._write(module, variable, _clone(value), ttl)
+
+    async def aset_many(self, module: str, values: dict, ttl: float = None):
+        self.set_many(module, values, ttl)
+
+    def _write(self, module: str, variable: str, value, ttl: float = None):
+        entry = (value, None if ttl is None else time.time() + ttl)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Database is closed")
+            self._cache.setdefault(module, {})[variable] = entry
+            was_idle = not self._pending
+            self._pending[(module, variable)] = entry
+            if was_idle or len(self._pending) >= self._max_pending:
+                self._wakeup.notify()
+        self._publish(module, variable, value)
+
+    def subscribe(self, module: str, callback):
+        """
+        Call ``callback(variable, value)`` after every change of the module.
+
+        ``value`` is ``REMOVED`` for removed and expired variables, and
+        ``variable`` is None when the module changed in an unknown way and
+        has to be read again. Callbacks run in the thread that made the
+        change, so they must be quick and must not block.
+        """
+        self.validate(module)
+        with self._lock:
+            self._subscribers.setdefault(module, []).append(callback)
+
+    def unsubscribe(self, module: str, callback):
+        with self._lock:
+            self._subscribers.get(module, []).remove(callback)
+
+    def _publish(self, module: str, variable: str, value):
+        callbacks = self._subscribers.get(module)
+        if not callbacks:
+            return
+        for callback in list(callbacks):
+            try:
+                callback(variable, _clone(value))
+            except Exception:
+                logging.exception("Database subscriber of %s failed", module)
+
+    def _on_remote_change(self, module: str, variable: str, value):
+        key = (module, variable)
+        with self._lock:
+            if variable is None:
+                # Pending writes survive this, they are newer than the database
+                self._cache.pop(module, None)
+                self._loaded.discard(module)
+            elif key in self._pending or key in self._inflight:
+                return
+            else:
+                cached = self._cache.setdefault(module, {})
+                if variable in cached and cached[variable][0] == value:
+                    # Our own write coming back from the database
+                    return
+                cached[variable] = (value, None)
+        self._publish(module, variable, value)
+
+    @contextmanager
+    def transaction(self):
+        # Keep the flusher away until the block ends, so all of its writes
+        # reach the backing database in the same commit
+        with self._lock:
+            self._holds += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._holds -= 1
+                self._wakeup.notify()
+
     def add_chat_history(self, user_id, message):
-        chat_history = self.get_chat_history(user_id, default=[])
-        chat_history.append(message)
-        self.set(f"core.cohere.user_{user_id}", "chat_history", chat_history)
+        # Chat history has its own append-only store, there is nothing to cache
+        return self._db.add_chat_history(user_id, message)
 
-    def get_chat_history(self, user_id, default=None):
-        if default is None:
-            default = []
-        return self.get(f"core.cohere.user_{user_id}", "chat_history", default=[])
+    def get_chat_history(self, user_id, default=None, limit=None):
+        return self._db.get_chat_history(user_id, default, limit)
 
-    def addaiuser(self, user_id):
-        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
-        if user_id not in chatai_users:
-            chatai_users.append(user_id)
-            self.set("core.chatbot", "chatai_users", chatai_users)
+    def clear_chat_history(self, user_id):
+        return self._db.clear_chat_history(user_id)
 
-    def remaiuser(self, user_id):
-        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
-        if user_id in chatai_users:
-            chatai_users.remove(user_id)
-            self.set("core.chatbot", "chatai_users", chatai_users)
+    def invalidate(self, module: str = None, variable: str = None):
+        """Drop cached reads so they are fetched from the database again"""
+        with self._lock:
+            if module is None:
+                self._cache.clear()
+                self._loaded.clear()
+            elif variable is None:
+                self._cache.pop(module, None)
+                self._loaded.discard(module)
+            else:
+                self._cache.get(module, {}).pop(variable, None)
+                self._loaded.discard(module)
 
-    def getaiusers(self):
-        return self.get("core.chatbot", "chatai_users", default=[])
+    def flush(self):
+        """Write all pending changes to the backing database"""
+        with self._flush_lock:
+            with self._lock:
+                self._inflight, self._pending = self._pending, {}
+            try:
+                self._db.run_sync(self._write_back, self._inflight)
+            except BaseException:
+                with self._lock:
+                    # Keep them for the next flush, writes made since are newer
+                    for key, entry in self._inflight.items():
+                        self._pending.setdefault(key, entry)
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+    def _write_back(self, changes: dict):
+        now = time.time()
+        batch = {}
+        for key, (value, expires) in changes.items():
+            ttl = None if expires is None else expires - now
+            if ttl is not None and ttl <= 0:
+                value, ttl = REMOVED, None
+            batch[key] = (value, ttl)
+        self._db.apply(batch)
+
+    def sweep(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            for module, cached in self._cache.items():
+                for var, entry in list(cached.items()):
+                    if self._value(entry, now) is _ABSENT:
+                        del cached[var]
+                        if entry[0] is not _ABSENT:
+                            expired.append((module, var))
+        for module, var in expired:
+            self._publish(module, var, REMOVED)
+        try:
+            self._db.run_sync(self._db.sweep)
+        except Exception:
+            logging.exception("Failed to delete expired keys from database")
+
+    def _flush_loop(self):
+        next_sweep = time.monotonic() + self._sweep_interval
+        while True:
+            with self._wakeup:
+                self._wakeup.wait_for(
+                    lambda: self._pending or self._closed,
+                    timeout=max(next_sweep - time.monotonic(), 0),
+                )
+                if self._closed:
+                    return
+                if self._pending:
+                    # Give concurrent writes a chance to be coalesced
+                    self._wakeup.wait(self._flush_delay)
+                    self._wakeup.wait_for(lambda: not self._holds or self._closed)
+            try:
+                self.flush()
+            except Exception:
+                # Writes stay pending and are retried after flush_delay
+                logging.exception("Failed to write changes to database")
+            if time.monotonic() >= next_sweep:
+                self.sweep()
+                next_sweep = time.monotonic() + self._sweep_interval
+
+    def close(self):
+        with self._wakeup:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._flusher.join()
+        self.flush()
+        self._db.close()
 
 
-if config.db_type in ["mongo", "mongodb"]:
-    db = MongoDatabase(config.db_url, config.db_name)
-else:
-    db = SqliteDatabase(config.db_name)
+with profiler.phase("db open"):
+    if config.db_type in ["mongo", "mongodb"]:
+        db = CachedDatabase(
+            MongoDatabase(
+                config.db_url,
+                config.db_name,
+                config.db_pool_size,
+                config.db_min_pool_size,
+            )
+        )
+    else:
+        db = CachedDatabase(SqliteDatabase(config.db_name))
@@ -0,0 +1,164 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict
+
+from pyrogram.errors import FloodWait, MessageNotModified
+from pyrogram.types import Message
+
+__all__ = ["EditScheduler", "edits"]
+
+
+class EditScheduler:
+    """
+    Shared scheduler for progress bars and status animations.
+
+    ``update`` doesn't wait for the API: it keeps only the latest text of
+    each message, and one worker per chat sends them within the chat's edit
+    budget (``rate`` edits a second, bursts up to ``burst``). Texts equal to
+    the one already shown are skipped, FloodWait pauses only that chat.
+
+    Use ``final`` for the text that must stay, it drops the pending update
+    of the message and waits for the one being sent, so a late progress
+    edit can't overwrite it.
+    """
+
+    def __init__(self, rate: float = 0.5, burst: int = 3, remember: int = 1024):
+        self.rate = rate
+        self.burst = burst
+        self._remember = remember
+        # chat_id -> {message_id: (message, text, kwargs)}, oldest first
+        self._pending: Dict[int, Dict[int, tuple]] = {}
+        # chat_id -> [tokens, updated at]
+        self._budgets: Dict[int, list] = {}
+        # chat_id -> monotonic time FloodWait ends at
+        self._paused: Dict[int, float] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # chat_id -> [message_id, sent event, cancelled] of the edit in flight
+        self._sending: Dict[int, list] = {}
+        # (chat_id, message_id) -> text on screen
+        self._shown = OrderedDict()
+
+    def update(self, message: Message, text: str, **kwargs):
+        """Show text in message soon, replacing any pending update of it"""
+        chat_id = message.chat.id
+        pending = self._pending.get(chat_id, {})
+        if message.id not in pending and self._shown.get((chat_id, message.id)) == text:
+            return
+        self._pending.setdefault(chat_id, pending)[message.id] = (message, text, kwargs)
+        if chat_id not in self._workers:
+            task = asyncio.get_running_loop().create_task(self._worker(chat_id))
+            self._workers[chat_id] = task
+
+    def cancel(self, message: Message):
+        """Forget the pending update of message"""
+        pending = self._pending.get(message.chat.id)
+        if pending:
+            pending.pop(message.id, None)
+        sending = self._sending.get(message.chat.id)
+        if sending and sending[0] == message.id:
+            # Don't let the worker queue it again after a FloodWait
+            sending[2] = True
+
+    async def final(self, message: Message, text: str, **kwargs) -> Message:
+        """Edit message now (within the chat budget) and drop pending updates"""
+        self.cancel(message)
+        sending = self._sending.get(message.chat.id)
+        if sending and sending[0] == message.id:
+            await sending[1].wait()
+        await self._take(message.chat.id)
+        while True:
+            try:
+                result = await message.edit_text(text, **kwargs)
+            except FloodWait as e:
+                self._pause(message.chat.id, e.value)
+                await asyncio.sleep(e.value)
+                continue
+            except MessageNotModified:
+                result = message
+            self._remember_text(message, text)
+            return result
+
+    def _remember_text(self, message: Message, text: str):
+        key = (message.chat.id, message.id)
+        self._shown[key] = text
+        self._shown.move_to_end(key)
+        if len(self._shown) > self._remember:
+            self._shown.popitem(last=False)
+
+    def _pause(self, chat_id: int, seconds: float):
+        self._paused[chat_id] = time.monotonic() + seconds
+        logging.warning("FloodWait of %ss for edits in chat %s", seconds, chat_id)
+
+    async def _take(self, chat_id: int):
+        """Wait for a token of the chat edit budget"""
+        while True:
+            now = time.monotonic()
+            paused = self._paused.get(chat_id, 0) - now
+            if paused > 0:
+                await asyncio.sleep(paused)
+                continue
+            tokens, updated = self._budgets.get(chat_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._budgets[chat_id] = [tokens - 1, now]
+                return
+            self._budgets[chat_id] = [tokens, now]
+            await asyncio.sleep((1 - tokens) / self.rate)
+
+    async def _worker(self, chat_id: int):
+        try:
+            while self._pending.get(chat_id):
+                await self._take(chat_id)
+                pending = self._pending.get(chat_id)
+                if not pending:
+                    break
+                message_id = next(iter(pending))
+                message, text, kwargs = pending.pop(message_id)
+                if self._shown.get((chat_id, message_id)) == text:
+                    continue
+                sending = [message_id, asyncio.Event(), False]
+                self._sending[chat_id] = sending
+                try:
+                    await message.edit_text(text, **kwargs)
+                except FloodWait as e:
+                    # Retry later unless a newer text came in or it was
+                    # cancelled meanwhile
+                    if not sending[2]:
+                        pending.setdefault(message_id, (message, text, kwargs))
+                    self._pause(chat_id, e.value)
+                    continue
+                except MessageNotModified:
+                    pass
+                except Exception as e:
+                    # Deleted message and such, nothing to retry
+                    logging.debug("Can't edit message %s: %s", message_id, e)
+                    continue
+                finally:
+                    del self._sending[chat_id]
+                    sending[1].set()
+                self._remember_text(message, text)
+        finally:
+            del self._workers[chat_id]
+            if not self._pending.get(chat_id):
+                self._pending.pop(chat_id, None)
+
+
+edits = EditScheduler()
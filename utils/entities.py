@@ -0,0 +1,200 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Union
+
+from pyrogram import Client, raw, types
+from pyrogram.errors import PeerIdInvalid, RPCError
+
+__all__ = ["EntityCache", "entities"]
+
+
+def _key(peer_id: Union[int, str]):
+    # Usernames are case-insensitive, "@name" and "name" are the same peer
+    if isinstance(peer_id, str):
+        return peer_id.lower().lstrip("@")
+    return peer_id
+
+
+class EntityCache:
+    """
+    TTL/LRU cache of users, chats and input peers, shared by all handlers.
+
+    Concurrent lookups of the same entity share one request. Errors aren't
+    cached. ``resolve_many`` fetches the missing users of a list with one
+    ``users.GetUsers`` call and the chats with one ``channels.GetChannels``
+    (plus ``messages.GetChats`` for basic groups).
+    """
+
+    def __init__(self, ttl: float = 600, maxsize: int = 4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # (kind, key) -> (value, expires at)
+        self._entries = OrderedDict()
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+    def _get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _put(self, key: tuple, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def _cached(self, key: tuple, fetch: Callable[[], Awaitable]):
+        value = self._get(key)
+        if value is not None:
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting, don't warn about it
+            future.exception()
+            raise
+        else:
+            self._put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    def invalidate(self, peer_id: Union[int, str] = None):
+        """Forget everything about peer_id, or about all peers"""
+        if peer_id is None:
+            self._entries.clear()
+            return
+        key = _key(peer_id)
+        for cached in [cached for cached in self._entries if cached[1] == key]:
+            del self._entries[cached]
+
+    async def get_me(self, client: Client) -> types.User:
+        # Filled by Client.start(), fetched again only if it wasn't
+        if client.me is not None:
+            return client.me
+        return await self._cached(("me", None), client.get_me)
+
+    async def get_users(self, client: Client, user_id: Union[int, str]) -> types.User:
+        return await self._cached(
+            ("user", _key(user_id)), lambda: client.get_users(user_id)
+        )
+
+    async def get_chat(self, client: Client, chat_id: Union[int, str]) -> types.Chat:
+        return await self._cached(
+            ("chat", _key(chat_id)), lambda: client.get_chat(chat_id)
+        )
+
+    async def resolve_peer(self, client: Client, peer_id: Union[int, str]):
+        return await self._cached(
+            ("peer", _key(peer_id)), lambda: client.resolve_peer(peer_id)
+        )
+
+    async def resolve_many(
+        self, client: Client, peer_ids: Iterable[int]
+    ) -> Dict[int, Union[types.User, types.Chat]]:
+        """
+        Get users (as User) and chats (as Chat) by id.
+
+        Ids that can't be resolved are left out of the result.
+        """
+        result = {}
+        missing = []
+        for peer_id in dict.fromkeys(peer_ids):
+            cached = self._get(("user", peer_id))
+            if cached is None:
+                cached = self._get(("brief", peer_id))
+            if cached is not None:
+                result[peer_id] = cached
+            else:
+                missing.append(peer_id)
+
+        # Mostly answered by the session storage, no need to wait in turn
+        peers = await asyncio.gather(
+            *(self.resolve_peer(client, peer_id) for peer_id in missing),
+            return_exceptions=True,
+        )
+        users, channels, chats = [], [], []
+        for peer in peers:
+            if isinstance(peer, (PeerIdInvalid, KeyError, ValueError)):
+                continue
+            if isinstance(peer, BaseException):
+                raise peer
+            if isinstance(peer, raw.types.InputPeerUser):
+                users.append(
+                    raw.types.InputUser(
+                        user_id=peer.user_id, access_hash=peer.access_hash
+                    )
+                )
+            elif isinstance(peer, raw.types.InputPeerChannel):
+                channels.append(
+                    raw.types.InputChannel(
+                        channel_id=peer.channel_id, access_hash=peer.access_hash
+                    )
+                )
+            elif isinstance(peer, raw.types.InputPeerChat):
+                chats.append(peer.chat_id)
+
+        requests = []
+        if users:
+            requests.append(raw.functions.users.GetUsers(id=users))
+        if channels:
+            requests.append(raw.functions.channels.GetChannels(id=channels))
+        if chats:
+            requests.append(raw.functions.messages.GetChats(id=chats))
+
+        for response in await asyncio.gather(
+            *(client.invoke(request) for request in requests),
+            return_exceptions=True,
+        ):
+            if isinstance(response, RPCError):
+                continue
+            if isinstance(response, BaseException):
+                raise response
+            if isinstance(response, list):
+                for user in response:
+                    parsed = types.User._parse(client, user)
+                    if parsed is not None:
+                        self._put(("user", parsed.id), parsed)
+                        result[parsed.id] = parsed
+            else:
+                for chat in response.chats:
+                    # ChannelForbidden and such have no details to show
+                    if not isinstance(chat, (raw.types.Chat, raw.types.Channel)):
+                        continue
+                    parsed = types.Chat._parse_chat(client, chat)
+                    self._put(("brief", parsed.id), parsed)
+                    result[parsed.id] = parsed
+        return result
+
+
+entities = EntityCache()
@@ -26,14 +26,10 @@ from pyrogram.errors import (
     UserAdminInvalid,
     UsernameInvalid,
 )
-from pyrogram.raw import functions, types
+from pyrogram.raw import functions
 from pyrogram.types import (
     ChatPermissions,
     ChatPrivileges,
-    InputMediaAudio,
-    InputMediaDocument,
-    InputMediaPhoto,
-    InputMediaVideo,
     Message,
 )
 from pyrogram.utils import (
@@ -41,10 +37,11 @@ from pyrogram.utils import (
     MAX_USER_ID,
     MIN_CHANNEL_ID,
     MIN_CHAT_ID,
-    get_channel_id,
 )
 
 from utils.db import db
+from utils.entities import entities
+from utils.media import media_cache
 from utils.misc import prefix
 from utils.scripts import format_exc, text
 
@@ -133,8 +130,10 @@ class BanHandler:
     async def ban_user(self, user_id):
         try:
             await self.client.ban_chat_member(self.message.chat.id, user_id)
-            self.channel = await self.client.resolve_peer(self.message.chat.id)
-            self.user_id = await self.client.resolve_peer(user_id)
+            self.channel = await entities.resolve_peer(
+                self.client, self.message.chat.id
+            )
+            self.user_id = await entities.resolve_peer(self.client, user_id)
             await self.handle_additional_actions()
             await self.edit_message()
         except UserAdminInvalid:
@@ -220,8 +219,10 @@ class UnbanHandler:
     async def unban_user(self, user_id):
         try:
             await self.client.unban_chat_member(self.message.chat.id, user_id)
-            self.channel = await self.client.resolve_peer(self.message.chat.id)
-            self.user_id = await self.client.resolve_peer(user_id)
+            self.channel = await entities.resolve_peer(
+                self.client, self.message.chat.id
+            )
+            self.user_id = await entities.resolve_peer(self.client, user_id)
             await self.edit_message()
         except UserAdminInvalid:
             await self.message.edit("<b>No rights</b>")
@@ -296,8 +297,10 @@ class KickHandler:
                 user_id,
                 datetime.now() + timedelta(minutes=1),
             )
-            self.channel = await self.client.resolve_peer(self.message.chat.id)
-            self.user_id = await self.client.resolve_peer(user_id)
+            self.channel = await entities.resolve_peer(
+                self.client, self.message.chat.id
+            )
+            self.user_id = await entities.resolve_peer(self.client, user_id)
             await self.handle_additional_actions()
             await self.client.unban_chat_member(
                 self.message.chat.id,
@@ -375,9 +378,10 @@ class TimeMuteHandler:
         self.message = message
         self.cause = text(message)
         self.chat_id = message.chat.id
-        self.tmuted_users = db.get("core.ats", f"c{self.chat_id}", [])
+        self.tmuted_users = []
 
     async def handle_tmute(self):
+        self.tmuted_users = await db.aget("core.ats", f"c{self.chat_id}", [])
         if self.message.reply_to_message:
             await self.handle_reply_tmute()
         elif not self.message.reply_to_message:
@@ -392,7 +396,7 @@ class TimeMuteHandler:
                 await self.message.edit(f"<b>{name}</b> <code>already in tmute</code>")
             else:
                 self.tmuted_users.append(user_for_tmute)
-                db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
+                await db.aset("core.ats", f"c{self.chat_id}", self.tmuted_users)
                 await self.message.edit(
                     f"<b>{name}</b> <code>in tmute</code>"
                     + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=1)[1] + '</i>' if len(self.cause.split()) > 1 else ''}",
@@ -410,7 +414,7 @@ class TimeMuteHandler:
                     )
                     if user_to_tmute.id not in self.tmuted_users:
                         self.tmuted_users.append(user_to_tmute.id)
-                        db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
+                        await db.aset("core.ats", f"c{self.chat_id}", self.tmuted_users)
                         await self.message.edit(
                             f"<b>{name}</b> <code>in tmute</code>"
                             + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=2)[2] + '</i>' if len(self.cause.split()) > 2 else ''}",
@@ -438,9 +442,10 @@ class TimeUnmuteHandler:
         self.message = message
         self.cause = text(message)
         self.chat_id = message.chat.id
-        self.tmuted_users = db.get("core.ats", f"c{self.chat_id}", [])
+        self.tmuted_users = []
 
     async def handle_tunmute(self):
+        self.tmuted_users = await db.aget("core.ats", f"c{self.chat_id}", [])
         if self.message.reply_to_message:
             await self.handle_reply_tunmute()
         elif not self.message.reply_to_message:
@@ -455,7 +460,7 @@ class TimeUnmuteHandler:
                 await self.message.edit(f"<b>{name}</b> <code>not in tmute</code>")
             else:
                 self.tmuted_users.remove(user_for_tunmute)
-                db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
+                await db.aset("core.ats", f"c{self.chat_id}", self.tmuted_users)
                 await self.message.edit(
                     f"<b>{name}</b> <code>tunmuted</code>"
                     + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=1)[1] + '</i>' if len(self.cause.split()) > 1 else ''}",
@@ -477,7 +482,7 @@ class TimeUnmuteHandler:
                         )
                     else:
                         self.tmuted_users.remove(user_to_tunmute.id)
-                        db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
+                        await db.aset("core.ats", f"c{self.chat_id}", self.tmuted_users)
                         await self.message.edit(
                             f"<b>{name}</b> <code>tunmuted</code>"
                             + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=2)[2] + '</i>' if len(self.cause.split()) > 2 else ''}",
@@ -500,20 +505,20 @@ class TimeMuteUsersHandler:
         self.client = client
         self.message = message
         self.chat_id = message.chat.id
-        self.tmuted_users = db.get("core.ats", f"c{self.chat_id}", [])
+        self.tmuted_users = []
 
     async def list_tmuted_users(self):
+        self.tmuted_users = await db.aget("core.ats", f"c{self.chat_id}", [])
         if self.message.chat.type not in ["private", "channel"]:
             text = f"<b>All users</b> <code>{self.message.chat.title}</code> <b>who are now in tmute</b>\n\n"
             count = 0
+            # One users.GetUsers and one channels.GetChannels for the whole list
+            found = await entities.resolve_many(self.client, self.tmuted_users)
             for user in self.tmuted_users:
-                try:
-                    name = await self.get_user_name(user)
-                    if name:
-                        count += 1
-                        text += f"{count}. <b>{name}</b>\n"
-                except PeerIdInvalid:
-                    pass
+                name = self.get_user_name(found.get(user))
+                if name:
+                    count += 1
+                    text += f"{count}. <b>{name}</b>\n"
             if count == 0:
                 await self.message.edit("<b>No users in tmute</b>")
             else:
@@ -522,26 +527,16 @@ class TimeMuteUsersHandler:
         else:
             await self.message.edit("<b>Unsupported</b>")
 
-    async def get_user_name(self, user_id):
-        try:
-            _name_ = await self.client.get_chat(user_id)
-            if await check_username_or_id(_name_.id) == "channel":
-                channel = await self.client.invoke(
-                    functions.channels.GetChannels(
-                        id=[
-                            types.InputChannel(
-                                channel_id=get_channel_id(_name_.id),
-                                access_hash=0,
-                            )
-                        ]
-                    )
-                )
-                return channel.chats[0].title
-            if await check_username_or_id(_name_.id) == "user":
-                user = await self.client.get_users(_name_.id)
-                return user.first_name
-        except PeerIdInvalid:
+    @staticmethod
+    def get_user_name(entity):
+        if entity is None:
             return None
+        # Deleted accounts have no first name
+        return (
+            getattr(entity, "first_name", None)
+            or getattr(entity, "title", None)
+            or str(entity.id)
+        )
 
 
 class UnmuteHandler:
@@ -949,25 +944,29 @@ class AntiChannelsHandler:
             )
 
     async def toggle_anti_channels_status(self):
-        current_status = db.get("core.ats", f"antich{self.chat_id}", False)
+        current_status = await db.aget("core.ats", f"antich{self.chat_id}", False)
         new_status = not current_status
-        db.set("core.ats", f"antich{self.chat_id}", new_status)
+        await db.aset("core.ats", f"antich{self.chat_id}", new_status)
         if new_status:
             await self.message.edit("<b>Blocking channels in this chat enabled.</b>")
         else:
             await self.message.edit("<b>Blocking channels in this chat disabled.</b>")
 
     async def enable_anti_channels(self):
-        db.set("core.ats", f"antich{self.chat_id}", True)
         group = await self.client.get_chat(self.chat_id)
-        if group.linked_chat:
-            db.set("core.ats", f"linked{self.chat_id}", group.linked_chat.id)
-        else:
-            db.set("core.ats", f"linked{self.chat_id}", 0)
+        await db.aset_many(
+            "core.ats",
+            {
+                f"antich{self.chat_id}": True,
+                f"linked{self.chat_id}": (
+                    group.linked_chat.id if group.linked_chat else 0
+                ),
+            },
+        )
         await self.message.edit("<b>Blocking channels in this chat enabled.</b>")
 
     async def disable_anti_channels(self):
-        db.set("core.ats", f"antich{self.chat_id}", False)
+        await db.aset("core.ats", f"antich{self.chat_id}", False)
         await self.message.edit("<b>Blocking channels in this chat disabled.</b>")
 
 
@@ -1035,8 +1034,8 @@ class DeleteHistoryHandler:
 
     async def delete_user_history(self, user_id, name):
         try:
-            channel = await self.client.resolve_peer(self.chat_id)
-            user_id = await self.client.resolve_peer(user_id)
+            channel = await entities.resolve_peer(self.client, self.chat_id)
+            user_id = await entities.resolve_peer(self.client, user_id)
             await self.client.invoke(
                 functions.channels.DeleteParticipantHistory(
                     channel=channel, participant=user_id
@@ -1072,36 +1071,45 @@ class AntiRaidHandler:
             await self.toggle_antiraid()
 
     async def enable_antiraid(self):
-        db.set("core.ats", f"antiraid{self.chat_id}", True)
         group = await self.client.get_chat(self.chat_id)
-        if group.linked_chat:
-            db.set("core.ats", f"linked{self.chat_id}", group.linked_chat.id)
-        else:
-            db.set("core.ats", f"linked{self.chat_id}", 0)
+        await db.aset_many(
+            "core.ats",
+            {
+                f"antiraid{self.chat_id}": True,
+                f"linked{self.chat_id}": (
+                    group.linked_chat.id if group.linked_chat else 0
+                ),
+            },
+        )
         await self.message.edit(
             "<b>Anti-raid mode enabled!\n"
             f"Disable with: </b><code>{self.prefix}antiraid off</code>"
         )
 
     async def disable_antiraid(self):
-        db.set("core.ats", f"antiraid{self.chat_id}", False)
+        await db.aset("core.ats", f"antiraid{self.chat_id}", False)
         await self.message.edit("<b>Anti-raid mode disabled</b>")
 
     async def toggle_antiraid(self):
-        current_status = db.get("core.ats", f"antiraid{self.chat_id}", False)
+        current_status = await db.aget("core.ats", f"antiraid{self.chat_id}", False)
         new_status = not current_status
-        db.set("core.ats", f"antiraid{self.chat_id}", new_status)
         if new_status:
             group = await self.client.get_chat(self.chat_id)
-            if group.linked_chat:
-                db.set("core.ats", f"linked{self.chat_id}", group.linked_chat.id)
-            else:
-                db.set("core.ats", f"linked{self.chat_id}", 0)
+            await db.aset_many(
+                "core.ats",
+                {
+                    f"antiraid{self.chat_id}": True,
+                    f"linked{self.chat_id}": (
+                        group.linked_chat.id if group.linked_chat else 0
+                    ),
+                },
+            )
             await self.message.edit(
                 "<b>Anti-raid mode enabled!\n"
                 f"Disable with: </b><code>{self.prefix}antiraid off</code>"
             )
         else:
+            await db.aset("core.ats", f"antiraid{self.chat_id}", False)
             await self.message.edit("<b>Anti-raid mode disabled</b>")
 
 
@@ -1117,11 +1125,14 @@ class NoteSendHandler:
             await self.message.edit("<b>Loading...</b>")
 
             note_name = self.message.text.split(maxsplit=1)[1]
-            find_note = db.get("core.notes", f"note{note_name}", False)
+            find_note = await db.aget("core.notes", f"note{note_name}", False)
             if find_note:
                 try:
                     await self.send_note(find_note)
                 except RPCError:
+                    media_cache.invalidate(
+                        int(find_note["CHAT_ID"]), int(find_note["MESSAGE_ID"])
+                    )
                     await self.message.edit(
                         "<b>Sorry, but this note is unavailable.\n\n"
                         f"You can delete this note with "
@@ -1143,10 +1154,9 @@ class NoteSendHandler:
             await self.copy_message(find_note)
 
     async def send_media_group(self, find_note):
-        messages_grouped = await self.client.get_media_group(
-            int(find_note["CHAT_ID"]), int(find_note["MESSAGE_ID"])
+        media_grouped_list = await media_cache.get_media_group(
+            self.client, int(find_note["CHAT_ID"]), int(find_note["MESSAGE_ID"])
         )
-        media_grouped_list = self.prepare_media_group(messages_grouped)
         if self.message.reply_to_message:
             await self.client.send_media_group(
                 self.message.chat.id,
@@ -1170,62 +1180,3 @@ class NoteSendHandler:
                 int(find_note["CHAT_ID"]),
                 int(find_note["MESSAGE_ID"]),
             )
-
-    def prepare_media_group(self, messages_grouped):
-        media_grouped_list = []
-        for _ in messages_grouped:
-            if _.photo:
-                media_grouped_list.append(self.prepare_photo(_))
-            elif _.video:
-                media_grouped_list.append(self.prepare_video(_))
-            elif _.audio:
-                media_grouped_list.append(self.prepare_audio(_))
-            elif _.document:
-                media_grouped_list.append(self.prepare_document(_))
-        return media_grouped_list
-
-    @staticmethod
-    def prepare_photo(message):
-        if message.caption:
-            return InputMediaPhoto(message.photo.file_id, message.caption.markdown)
-        return InputMediaPhoto(message.photo.file_id)
-
-    @staticmethod
-    def prepare_video(message):
-        if message.caption:
-            if message.video.thumbs:
-                return InputMediaVideo(
-                    message.video.file_id,
-                    message.video.thumbs[0].file_id,
-                    message.caption.markdown,
-                )
-            return InputMediaVideo(message.video.file_id, message.caption.markdown)
-        if message.video.thumbs:
-            return InputMediaVideo(
-                message.video.file_id, message.video.thumbs[0].file_id
-            )
-        return InputMediaVideo(message.video.file_id)
-
-    @staticmethod
-    def prepare_audio(message):
-        if message.caption:
-            return InputMediaAudio(message.audio.file_id, message.caption.markdown)
-        return InputMediaAudio(message.audio.file_id)
-
-    @staticmethod
-    def prepare_document(message):
-        if message.caption:
-            if message.document.thumbs:
-                return InputMediaDocument(
-                    message.document.file_id,
-                    message.document.thumbs[0].file_id,
-                    message.caption.markdown,
-                )
-            return InputMediaDocument(
-                message.document.file_id, message.caption.markdown
-            )
-        if message.document.thumbs:
-            return InputMediaDocument(
-                message.document.file_id, message.document.thumbs[0].file_id
-            )
-        return InputMediaDocument(message.document.file_id)
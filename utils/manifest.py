@@ -0,0 +1,235 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Static manifests of modules, read from the source without importing it.
+
+A manifest lists the commands of each handler group and the help of the
+module. A module is lazy, so it can be imported on the first command, when
+every handler it has is a plain command handler:
+``@Client.on_message(filters.command(<literal>, prefix) & ...)``. Anything
+else (passive handlers, other update types, commands inside ``|``/``~``,
+help that isn't a literal) keeps the module loaded at startup, and so does
+a ``# meta lazy: no`` comment.
+
+Manifests, together with the meta comments of each module, are kept in
+``MANIFEST_FILE`` and only files whose mtime or size changed are read at
+startup (and parsed again only if their hash changed too).
+"""
+
+import ast
+import hashlib
+import json
+import logging
+import os
+import re
+import warnings
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .scripts import parse_meta_comments
+
+__all__ = ["MANIFEST_FILE", "scan", "load"]
+
+MANIFEST_FILE = "modules_manifest.json"
+# Bump when scan() rules change, so old manifests aren't trusted
+VERSION = 1
+
+LAZY_OPT_OUT = re.compile(r"^ *# *meta +lazy *: *(no|false|0)\s*$", re.I | re.M)
+
+
+class NotLazy(Exception):
+    pass
+
+
+def _literal(node: ast.AST):
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        raise NotLazy from None
+
+
+def _command(node: ast.AST) -> Optional[List[str]]:
+    """Get command names if node is filters.command(..., prefix)"""
+    if not (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr == "command"
+        and isinstance(node.func.value, ast.Name)
+        and node.func.value.id == "filters"
+    ):
+        return None
+    if not node.args:
+        raise NotLazy
+    names = _literal(node.args[0])
+    if isinstance(names, str):
+        names = [names]
+    # The userbot prefix is the only one the stubs are registered with
+    prefixes = node.args[1:2] + [
+        kw.value for kw in node.keywords if kw.arg == "prefixes"
+    ]
+    if len(prefixes) != 1 or not (
+        isinstance(prefixes[0], ast.Name) and prefixes[0].id == "prefix"
+    ):
+        raise NotLazy
+    return [name.lower() for name in names]
+
+
+def _required_commands(node: ast.AST) -> List[str]:
+    """Get commands that the whole filter requires, raise if there are none"""
+    commands = _command(node)
+    if commands is not None:
+        return commands
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+        for side in (node.left, node.right):
+            try:
+                return _required_commands(side)
+            except NotLazy:
+                continue
+    raise NotLazy
+
+
+def _handler(decorator: ast.AST):
+    """Get (group, commands) of a Client.on_* decorator, None for others"""
+    if not (
+        isinstance(decorator, ast.Call)
+        and isinstance(decorator.func, ast.Attribute)
+        and isinstance(decorator.func.value, ast.Name)
+        and decorator.func.value.id == "Client"
+        and decorator.func.attr.startswith("on_")
+    ):
+        return None
+    if decorator.func.attr != "on_message" or not decorator.args:
+        raise NotLazy
+    group = 0
+    if len(decorator.args) > 1:
+        group = _literal(decorator.args[1])
+    for kw in decorator.keywords:
+        if kw.arg == "group":
+            group = _literal(kw.value)
+    return group, _required_commands(decorator.args[0])
+
+
+def _help(node: ast.stmt) -> Optional[tuple]:
+    """Get (name, help) of a ``modules_help["name"] = {...}`` statement"""
+    if not (
+        isinstance(node, ast.Assign)
+        and len(node.targets) == 1
+        and isinstance(node.targets[0], ast.Subscript)
+        and isinstance(node.targets[0].value, ast.Name)
+        and node.targets[0].value.id == "modules_help"
+    ):
+        return None
+    return _literal(node.targets[0].slice), _literal(node.value)
+
+
+def scan(source: str) -> Dict:
+    """
+    Get the manifest of module source.
+
+    ``{"lazy": bool, "commands": {group: [names]}, "help": {name: help}}``,
+    commands and help are empty for modules that aren't lazy.
+    """
+    not_lazy = {"lazy": False, "commands": {}, "help": {}}
+    if LAZY_OPT_OUT.search(source):
+        return not_lazy
+    try:
+        # Invalid escapes and such are reported when the module is imported
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", SyntaxWarning)
+            tree = ast.parse(source)
+    except SyntaxError:
+        return not_lazy
+
+    commands: Dict[int, List[str]] = {}
+    help_pages = {}
+    try:
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                for decorator in node.decorator_list:
+                    handler = _handler(decorator)
+                    if handler is not None:
+                        group, names = handler
+                        known = commands.setdefault(group, [])
+                        known.extend(name for name in names if name not in known)
+        for node in tree.body:
+            page = _help(node)
+            if page is not None:
+                help_pages[page[0]] = page[1]
+    except NotLazy:
+        return not_lazy
+
+    if not commands:
+        # Nothing to wake it up with
+        return not_lazy
+    return {"lazy": True, "commands": commands, "help": help_pages}
+
+
+def _read(path: str) -> Dict[str, dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != VERSION:
+        return {}
+    return data.get("modules", {})
+
+
+def _write(path: str, modules: Dict[str, dict]):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": VERSION, "modules": modules}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load(paths: Iterable[Path], cache_path: str = MANIFEST_FILE) -> Dict[str, dict]:
+    """
+    Get manifests of module files by import path (``modules.name``).
+
+    Each one is a scan() result plus ``meta``, the parsed meta comments.
+    Group keys of ``commands`` are strings for manifests read from the cache.
+    """
+    cached = _read(cache_path)
+    manifests = {}
+    for path in paths:
+        key = ".".join(path.with_suffix("").parts)
+        stat = path.stat()
+        entry = cached.get(key)
+        if (
+            entry is not None
+            and entry["mtime"] == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            manifests[key] = entry
+            continue
+
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry is None or entry["hash"] != digest:
+            source = data.decode("utf-8")
+            entry = {"hash": digest, "meta": parse_meta_comments(source)}
+            entry.update(scan(source))
+        # Touched but unchanged files (git checkout and such) keep their entry
+        entry.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+        manifests[key] = entry
+
+    if manifests != cached:
+        try:
+            _write(cache_path, manifests)
+        except OSError as e:
+            logging.warning("Can't save module manifest: %s", e)
+    return manifests
@@ -0,0 +1,106 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from typing import List
+
+from pyrogram import Client
+from pyrogram.types import (
+    InputMedia,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message,
+)
+
+__all__ = ["prepare_media", "prepare_media_group", "MediaCache", "media_cache"]
+
+
+def prepare_media(message: Message) -> InputMedia:
+    """Build InputMedia that sends the media of message again"""
+    caption = message.caption.html if message.caption else ""
+    if message.photo:
+        return InputMediaPhoto(message.photo.file_id, caption)
+    if message.video:
+        thumb = message.video.thumbs[0].file_id if message.video.thumbs else None
+        return InputMediaVideo(message.video.file_id, thumb, caption)
+    if message.audio:
+        return InputMediaAudio(message.audio.file_id, caption=caption)
+    if message.document:
+        thumb = message.document.thumbs[0].file_id if message.document.thumbs else None
+        return InputMediaDocument(message.document.file_id, thumb, caption)
+    return None
+
+
+def prepare_media_group(messages: List[Message]) -> List[InputMedia]:
+    return [media for media in map(prepare_media, messages) if media is not None]
+
+
+class MediaCache:
+    """
+    LRU cache of stored notes and filters prepared for sending, keyed by
+    (chat_id, message_id) of the stored message.
+
+    A media group is cached as its InputMedia list and a single message as
+    the fact that it exists, so a cache hit is answered with one API call.
+    Callers invalidate the entry when sending the stored message fails.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_media_group(
+        self, client: Client, chat_id: int, message_id: int
+    ) -> List[InputMedia]:
+        key = (chat_id, message_id)
+        media = self._get(key)
+        if media is None:
+            media = prepare_media_group(
+                await client.get_media_group(chat_id, message_id)
+            )
+            self._put(key, media)
+        return media
+
+    async def message_exists(
+        self, client: Client, chat_id: int, message_id: int
+    ) -> bool:
+        key = (chat_id, message_id)
+        if self._get(key) is None:
+            message = await client.get_messages(chat_id, message_id)
+            if message.empty:
+                return False
+            self._put(key, True)
+        return True
+
+    def invalidate(self, chat_id: int, message_id: int):
+        self._entries.pop((chat_id, message_id), None)
+
+
+media_cache = MediaCache()
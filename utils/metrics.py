@@ -0,0 +1,220 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+from typing import Dict, List
+
+from pyrogram import ContinuePropagation, StopPropagation
+from pyrogram.handlers.handler import Handler
+
+__all__ = [
+    "STATS_FILE",
+    "HandlerStats",
+    "instrument",
+    "snapshot",
+    "reset",
+    "top",
+    "dump",
+    "dump_loop",
+]
+
+# Written by dump_loop and served by app.py at /stats
+STATS_FILE = "stats.json"
+
+
+class HandlerStats:
+    """Counters of one handler, times are in seconds"""
+
+    __slots__ = (
+        "module",
+        "name",
+        "group",
+        "checks",
+        "check_time",
+        "check_max",
+        "calls",
+        "call_time",
+        "call_max",
+        "continued",
+        "errors",
+    )
+
+    def __init__(self, module: str, name: str, group: int):
+        self.module = module
+        self.name = name
+        self.group = group
+        self.reset()
+
+    def reset(self):
+        self.checks = 0
+        self.check_time = 0.0
+        self.check_max = 0.0
+        self.calls = 0
+        self.call_time = 0.0
+        self.call_max = 0.0
+        self.continued = 0
+        self.errors = 0
+
+    def add_check(self, elapsed: float):
+        self.checks += 1
+        self.check_time += elapsed
+        self.check_max = max(self.check_max, elapsed)
+
+    def add_call(self, elapsed: float):
+        self.calls += 1
+        self.call_time += elapsed
+        self.call_max = max(self.call_max, elapsed)
+
+    def as_dict(self) -> dict:
+        return {
+            "module": self.module,
+            "handler": self.name,
+            "group": self.group,
+            "checks": self.checks,
+            "check_time": self.check_time,
+            "check_max": self.check_max,
+            "calls": self.calls,
+            "call_time": self.call_time,
+            "call_avg": self.call_time / self.calls if self.calls else 0.0,
+            "call_max": self.call_max,
+            "continued": self.continued,
+            "continue_rate": self.continued / self.calls if self.calls else 0.0,
+            "errors": self.errors,
+        }
+
+
+# "module.handler" -> stats, kept across module reloads
+stats: Dict[str, HandlerStats] = {}
+started = time.time()
+
+
+def _wrap_check(check, record: HandlerStats):
+    @functools.wraps(check)
+    async def timed_check(client, update):
+        start = time.perf_counter()
+        try:
+            return await check(client, update)
+        finally:
+            record.add_check(time.perf_counter() - start)
+
+    return timed_check
+
+
+def _wrap_callback(callback, record: HandlerStats):
+    def finish(start: float, error: BaseException = None):
+        record.add_call(time.perf_counter() - start)
+        if isinstance(error, ContinuePropagation):
+            record.continued += 1
+        elif error is not None and not isinstance(error, StopPropagation):
+            record.errors += 1
+
+    if inspect.iscoroutinefunction(callback):
+
+        @functools.wraps(callback)
+        async def timed_callback(*args):
+            start = time.perf_counter()
+            try:
+                result = await callback(*args)
+            except BaseException as e:
+                finish(start, e)
+                raise
+            finish(start)
+            return result
+
+    else:
+        # Runs in the client executor, like the callback itself would
+
+        @functools.wraps(callback)
+        def timed_callback(*args):
+            start = time.perf_counter()
+            try:
+                result = callback(*args)
+            except BaseException as e:
+                finish(start, e)
+                raise
+            finish(start)
+            return result
+
+    return timed_callback
+
+
+def instrument(handler: Handler, module: str, group: int = 0) -> Handler:
+    """
+    Record filter and callback timings of handler.
+
+    Wraps ``check`` and ``callback`` of the handler object in place, so it
+    can still be added and removed from the client as before.
+    """
+    if getattr(handler, "stats", None) is not None:
+        return handler
+
+    # MessageHandler and friends keep the user function aside and call it
+    # through their own listener-aware callback
+    function = getattr(handler, "original_callback", handler.callback)
+    key = f"{module}.{function.__name__}"
+    record = stats.get(key)
+    if record is None:
+        record = stats[key] = HandlerStats(module, function.__name__, group)
+
+    handler.check = _wrap_check(handler.check, record)
+    handler.callback = _wrap_callback(handler.callback, record)
+    handler.stats = record
+    return handler
+
+
+def snapshot() -> dict:
+    return {
+        "since": started,
+        "time": time.time(),
+        "handlers": [record.as_dict() for record in stats.values()],
+    }
+
+
+def reset():
+    global started
+    started = time.time()
+    for record in stats.values():
+        record.reset()
+
+
+def top(sort: str = "call_time", limit: int = 10) -> List[dict]:
+    """Get handlers with the largest value of ``sort``"""
+    handlers = snapshot()["handlers"]
+    handlers.sort(key=lambda item: item[sort], reverse=True)
+    return handlers[:limit]
+
+
+def dump(path: str = STATS_FILE):
+    # Write next to the target and rename, readers never see half a file
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)
+
+
+async def dump_loop(path: str = STATS_FILE, interval: float = 30):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            dump(path)
+        except OSError:
+            logging.warning("Can't write handler stats to %s", path, exc_info=True)
@@ -16,6 +16,7 @@
 
 from sys import version_info
 from .db import db
+from .profiler import profiler
 import git
 
 __all__ = [
@@ -24,6 +25,7 @@ __all__ = [
     "python_version",
     "prefix",
     "gitrepo",
+    "fetch_gitrepo",
     "userbot_version",
 ]
 
@@ -35,21 +37,47 @@ python_version = f"{version_info[0]}.{version_info[1]}.{version_info[2]}"
 
 prefix = db.get("core.main", "prefix", ".")
 
-try:
-    gitrepo = git.Repo(".")
-except git.exc.InvalidGitRepositoryError:
-    repo = git.Repo.init()
-    origin = repo.create_remote(
-        "origin", "https://github.com/The-MoonTg-project/Moon-Userbot"
-    )
+GIT_REMOTE = "https://github.com/The-MoonTg-project/Moon-Userbot"
+
+with profiler.phase("git repo"):
+    try:
+        gitrepo = git.Repo(".")
+    except git.exc.InvalidGitRepositoryError:
+        # Only the local part, fetch_gitrepo() gets the code once the bot is up
+        gitrepo = git.Repo.init()
+        gitrepo.create_remote("origin", GIT_REMOTE)
+
+
+def fetch_gitrepo() -> bool:
+    """Check out upstream main in a repo made by git init, False if done before"""
+    if gitrepo.head.is_valid():
+        return False
+    origin = gitrepo.remote("origin")
     origin.fetch()
-    repo.create_head("main", origin.refs.main)
-    repo.heads.main.set_tracking_branch(origin.refs.main)
-    repo.heads.main.checkout(True)
-    gitrepo = git.Repo(".")
-
-if len(gitrepo.tags) > 0:
-    commits_since_tag = list(gitrepo.iter_commits(f"{gitrepo.tags[-1].name}..HEAD"))
-else:
-    commits_since_tag = []
-userbot_version = f"2.0.{len(commits_since_tag)}"
+    gitrepo.create_head("main", origin.refs.main)
+    gitrepo.heads.main.set_tracking_branch(origin.refs.main)
+    gitrepo.heads.main.checkout(True)
+    return True
+
+
+def get_userbot_version() -> str:
+    if not gitrepo.head.is_valid():
+        return "2.0.0"
+
+    tag = gitrepo.tags[-1].name if len(gitrepo.tags) > 0 else None
+    key = f"{gitrepo.head.commit.hexsha}:{tag}"
+    cached = db.get("core.main", "version")
+    if cached and cached["key"] == key:
+        return cached["version"]
+
+    # git counts them without building a Commit object for each
+    commits_since_tag = (
+        int(gitrepo.git.rev_list("--count", f"{tag}..HEAD")) if tag else 0
+    )
+    version = f"2.0.{commits_since_tag}"
+    db.set("core.main", "version", {"key": key, "version": version})
+    return version
+
+
+with profiler.phase("version"):
+    userbot_version = get_userbot_version()
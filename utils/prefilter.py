@@ -0,0 +1,79 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Cheap gates for passive handlers, the ones that look at (almost) every
+incoming message but act only in a few chats or for a few users.
+
+Put a gate first in the handler filter, ``chat_in(ACTIVE) & ~filters.me``,
+so messages the handler doesn't care about are rejected by one lookup,
+before the rest of the filter runs and before the callback is scheduled.
+Gates are async and never block, so pyrogram doesn't hand them over to
+its thread pool like it does with plain function filters.
+
+The containers are read live: modules keep adding and removing chats in
+their own dict or set, and the gate follows.
+"""
+
+from typing import Callable, Collection, Iterable
+
+from pyrogram import filters
+from pyrogram.filters import Filter
+
+from utils.triggers import CONTAINS, TriggerIndex
+
+__all__ = ["chat_in", "user_in", "when", "text_contains"]
+
+
+async def _chat_in(flt, _, message) -> bool:
+    return message.chat is not None and message.chat.id in flt.chats
+
+
+async def _user_in(flt, _, message) -> bool:
+    return message.from_user is not None and message.from_user.id in flt.users
+
+
+async def _when(flt, _, __) -> bool:
+    return bool(flt.predicate())
+
+
+async def _text_contains(flt, _, message) -> bool:
+    text = message.text or message.caption
+    return bool(text) and flt.index.match(text) is not None
+
+
+def chat_in(chats: Collection[int]) -> Filter:
+    """Pass messages from chats in ``chats``"""
+    return filters.create(_chat_in, "ChatGate", chats=chats)
+
+
+def user_in(users: Collection[int]) -> Filter:
+    """Pass messages from users in ``users``"""
+    return filters.create(_user_in, "UserGate", users=users)
+
+
+def when(predicate: Callable[[], bool]) -> Filter:
+    """Pass all messages while ``predicate()`` is true, for module-wide toggles"""
+    # Stored on the filter class, keep it from becoming a bound method
+    return filters.create(_when, "FlagGate", predicate=staticmethod(predicate))
+
+
+def text_contains(words: Iterable[str]) -> Filter:
+    """Pass messages whose text or caption contains any of ``words``"""
+    index = TriggerIndex()
+    for word in words:
+        index.add(word, mode=CONTAINS)
+    return filters.create(_text_contains, "TextGate", index=index)
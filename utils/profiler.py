@@ -0,0 +1,183 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Startup profile for ``main.py --profile-startup[=path]``.
+
+Phases (db open, version, app.start() and such) are timed always, it's a
+couple of perf_counter() calls each. Import times are only recorded once
+start() puts a finder in front of sys.meta_path, so it has to be called
+before the imports it should see. Modules are imported by several threads
+at once, so import times add up to more than the wall time.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+from typing import Dict, List
+
+__all__ = ["PROFILE_FILE", "StartupProfiler", "profiler"]
+
+PROFILE_FILE = "startup_profile.json"
+
+STDLIB = getattr(sys, "stdlib_module_names", frozenset(sys.builtin_module_names))
+# Packages of this repo, everything else that isn't stdlib is a dependency
+OWN_PACKAGES = ("modules", "utils", "main")
+
+
+class _TimedLoader:
+    def __init__(self, loader, profiler: "StartupProfiler"):
+        self.loader = loader
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        try:
+            with self.profiler._importing(module.__name__):
+                self.loader.exec_module(module)
+        finally:
+            # Don't leave the wrapper around for code that checks loader types
+            module.__loader__ = self.loader
+            if module.__spec__ is not None:
+                module.__spec__.loader = self.loader
+
+
+class _ImportTimer(MetaPathFinder):
+    def __init__(self, profiler: "StartupProfiler"):
+        self.profiler = profiler
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self.profiler)
+        return spec
+
+
+class StartupProfiler:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.enabled = False
+        # phase -> [seconds, times entered]
+        self.phases: Dict[str, List[float]] = {}
+        # module -> [seconds with its imports, seconds of its own code]
+        self.imports: Dict[str, List[float]] = {}
+        self._finder = _ImportTimer(self)
+        self._stacks = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        sys.meta_path.insert(0, self._finder)
+
+    def stop(self):
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        self.enabled = False
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                phase = self.phases.setdefault(name, [0.0, 0])
+                phase[0] += elapsed
+                phase[1] += 1
+
+    @contextmanager
+    def _importing(self, name: str):
+        stack = getattr(self._stacks, "stack", None)
+        if stack is None:
+            stack = self._stacks.stack = []
+        # [name, seconds of nested imports]
+        frame = [name, 0.0]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            with self._lock:
+                self.imports[name] = [elapsed, elapsed - frame[1]]
+
+    def report(self) -> dict:
+        modules = {}
+        dependencies = {}
+        own = stdlib = 0.0
+        for name, (total, self_time) in self.imports.items():
+            package = name.split(".", 1)[0]
+            if package == "modules":
+                modules[name] = total
+            if package in OWN_PACKAGES:
+                own += self_time
+            elif package in STDLIB:
+                stdlib += self_time
+            else:
+                dependencies[package] = dependencies.get(package, 0.0) + self_time
+
+        def ordered(times: Dict[str, float]) -> Dict[str, float]:
+            return {
+                name: round(seconds, 6)
+                for name, seconds in sorted(times.items(), key=lambda item: -item[1])
+            }
+
+        return {
+            "total": round(time.perf_counter() - self.started, 6),
+            "phases": {
+                name: {"seconds": round(seconds, 6), "count": count}
+                for name, (seconds, count) in self.phases.items()
+            },
+            "imports": {
+                # With the imports each of them started, own code otherwise
+                "modules": ordered(modules),
+                "dependencies": ordered(dependencies),
+                "own": round(own, 6),
+                "stdlib": round(stdlib, 6),
+                "count": len(self.imports),
+            },
+        }
+
+    def dump(self, path: str = PROFILE_FILE):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(tmp, path)
+
+
+profiler = StartupProfiler()
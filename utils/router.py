@@ -0,0 +1,154 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import inspect
+from typing import Dict, List, Optional
+
+from pyrogram import Client, filters
+from pyrogram.filters import AndFilter, Filter
+from pyrogram.handlers import MessageHandler
+from pyrogram.handlers.handler import Handler
+from pyrogram.types import Message
+
+__all__ = ["CommandRouter", "router"]
+
+
+def command_filter(flt: Optional[Filter]) -> Optional[Filter]:
+    """Find filters.command() that the whole filter requires, if any"""
+    if isinstance(flt, AndFilter):
+        return command_filter(flt.base) or command_filter(flt.other)
+    if hasattr(flt, "commands") and hasattr(flt, "prefixes"):
+        return flt
+    return None
+
+
+class _GroupRoutes:
+    def __init__(self):
+        # (prefix, command) -> handlers in registration order
+        self.routes: Dict[tuple, List[Handler]] = {}
+        self.prefixes: Dict[str, int] = {}
+        self.handler: Optional[MessageHandler] = None
+
+    def add(self, handler: Handler, command: Filter):
+        for prefix in command.prefixes:
+            self.prefixes[prefix] = self.prefixes.get(prefix, 0) + 1
+            for name in command.commands:
+                self.routes.setdefault((prefix, name), []).append(handler)
+
+    def remove(self, handler: Handler, command: Filter):
+        for prefix in command.prefixes:
+            self.prefixes[prefix] -= 1
+            if not self.prefixes[prefix]:
+                del self.prefixes[prefix]
+            for name in command.commands:
+                handlers = self.routes[prefix, name]
+                handlers.remove(handler)
+                if not handlers:
+                    del self.routes[prefix, name]
+
+    def candidates(self, text: str) -> List[Handler]:
+        found = []
+        for prefix in self.prefixes:
+            if not text.startswith(prefix):
+                continue
+            words = text[len(prefix) :].split(maxsplit=1)
+            if not words:
+                continue
+            # "cmd@username" is matched by the command filter itself
+            name = words[0].split("@", 1)[0]
+            for key in {name, name.lower()}:
+                for handler in self.routes.get((prefix, key), ()):
+                    if handler not in found:
+                        found.append(handler)
+        return found
+
+
+class CommandRouter:
+    """
+    Dispatches command handlers through one hash lookup per message.
+
+    Message handlers whose filter requires ``filters.command(...)`` aren't
+    added to the client one by one. Each handler group gets a single router
+    handler instead, which reads the command word once, picks the handlers
+    registered for it, and runs the first one whose full filter passes
+    (so ``filters.me`` and such still apply, and ``message.command`` is
+    filled as usual). Other handlers are added to the client unchanged.
+    """
+
+    def __init__(self):
+        self._groups: Dict[int, _GroupRoutes] = {}
+
+    def add_handler(self, client: Client, handler: Handler, group: int = 0):
+        command = self._routable(handler)
+        if command is None:
+            client.add_handler(handler, group)
+            return
+
+        routes = self._groups.get(group)
+        if routes is None:
+            routes = self._groups[group] = _GroupRoutes()
+            routes.handler = MessageHandler(
+                self._dispatch, filters.create(self._match, routes=routes)
+            )
+            client.add_handler(routes.handler, group)
+        routes.add(handler, command)
+
+    def remove_handler(self, client: Client, handler: Handler, group: int = 0):
+        command = self._routable(handler)
+        if command is None:
+            client.remove_handler(handler, group)
+            return
+
+        routes = self._groups[group]
+        routes.remove(handler, command)
+        if not routes.routes:
+            client.remove_handler(routes.handler, group)
+            del self._groups[group]
+
+    def commands(self) -> Dict[int, List[tuple]]:
+        """Get routed (prefix, command) pairs by handler group"""
+        return {group: list(routes.routes) for group, routes in self._groups.items()}
+
+    @staticmethod
+    def _routable(handler: Handler) -> Optional[Filter]:
+        # Edited messages and other update types keep their own handlers
+        if type(handler) is not MessageHandler:
+            return None
+        return command_filter(handler.filters)
+
+    @staticmethod
+    async def _match(flt, client: Client, message: Message) -> bool:
+        text = message.text or message.caption
+        if not text:
+            return False
+        for handler in flt.routes.candidates(text):
+            if await handler.check(client, message):
+                message._route = handler
+                return True
+        return False
+
+    @staticmethod
+    async def _dispatch(client: Client, message: Message):
+        handler = message._route
+        if inspect.iscoroutinefunction(handler.callback):
+            await handler.callback(client, message)
+        else:
+            await client.loop.run_in_executor(
+                client.executor, handler.callback, client, message
+            )
+
+
+router = CommandRouter()
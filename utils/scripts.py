@@ -22,22 +22,33 @@ import re
 import shlex
 import subprocess
 import sys
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from io import BytesIO
 from types import ModuleType
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 
 import psutil
-from pyrogram import Client, errors, filters
-from pyrogram.errors import FloodWait, MessageNotModified, UserNotParticipant
+from pyrogram import Client, ContinuePropagation, errors, filters
+from pyrogram.errors import UserNotParticipant
+from pyrogram.handlers import MessageHandler
+from pyrogram.handlers.handler import Handler
 from pyrogram.types import Message
 from pyrogram.enums import ChatMembersFilter
 
 from utils.db import db
 
+from .editor import edits
 from .misc import modules_help, prefix, requirements_list
+from .metrics import instrument
+from .profiler import profiler
+from .router import router
+
+# restart_info is only useful to the instance that starts right after it was set
+RESTART_INFO_TTL = 60 * 60
 
 META_COMMENTS = re.compile(r"^ *# *meta +(\S+) *: *(.*?)\s*$", re.MULTILINE)
 interact_with_to_delete = []
@@ -114,37 +125,29 @@ async def progress(current, total, message, start, type_of_ps, file_name=None):
     """Progress Bar For Showing Progress While Uploading / Downloading File - Normal"""
     now = time.time()
     diff = now - start
-    if round(diff % 10.00) == 0 or current == total:
-        percentage = current * 100 / total
-        speed = current / diff
-        elapsed_time = round(diff) * 1000
-        if elapsed_time == 0:
-            return
-        time_to_completion = round((total - current) / speed) * 1000
-        estimated_total_time = elapsed_time + time_to_completion
-        progress_str = f"{''.join(['▰' for i in range(math.floor(percentage / 10))])}"
-        progress_str += (
-            f"{''.join(['▱' for i in range(10 - math.floor(percentage / 10))])}"
-        )
-        progress_str += f"{round(percentage, 2)}%\n"
-        tmp = f"{progress_str}{humanbytes(current)} of {humanbytes(total)}\n"
-        tmp += f"ETA: {time_formatter(estimated_total_time)}"
-        if file_name:
-            try:
-                await message.edit(
-                    f"{type_of_ps}\n<b>File Name:</b> <code>{file_name}</code>\n{tmp}"
-                )
-            except FloodWait as e:
-                await asyncio.sleep(e.x)
-            except MessageNotModified:
-                pass
-        else:
-            try:
-                await message.edit(f"{type_of_ps}\n{tmp}")
-            except FloodWait as e:
-                await asyncio.sleep(e.x)
-            except MessageNotModified:
-                pass
+    elapsed_time = round(diff) * 1000
+    if elapsed_time == 0:
+        return
+    percentage = current * 100 / total
+    speed = current / diff
+    time_to_completion = round((total - current) / speed) * 1000
+    estimated_total_time = elapsed_time + time_to_completion
+    progress_str = f"{''.join(['▰' for i in range(math.floor(percentage / 10))])}"
+    progress_str += f"{''.join(['▱' for i in range(10 - math.floor(percentage / 10))])}"
+    progress_str += f"{round(percentage, 2)}%\n"
+    tmp = f"{progress_str}{humanbytes(current)} of {humanbytes(total)}\n"
+    tmp += f"ETA: {time_formatter(estimated_total_time)}"
+    if file_name:
+        text = f"{type_of_ps}\n<b>File Name:</b> <code>{file_name}</code>\n{tmp}"
+    else:
+        text = f"{type_of_ps}\n{tmp}"
+
+    # Edits are coalesced and rate limited per chat, the last one is sent
+    # right away so the caller's next edit isn't overwritten by a late one
+    if current == total:
+        await edits.final(message, text)
+    else:
+        edits.update(message, text)
 
 
 async def run_cmd(prefix: str) -> Tuple[str, str, int, int]:
@@ -219,6 +222,7 @@ def restart() -> None:
             music_bot_process.terminate()
         except psutil.NoSuchProcess:
             print("Music bot is not running.")
+    db.close()
     os.execvp(sys.executable, [sys.executable, "main.py"])
 
 
@@ -333,6 +337,9 @@ def format_small_module_help(module_name: str, full=True):
     return help_text
 
 
+_pip_lock = threading.Lock()
+
+
 def import_library(library_name: str, package_name: str = None):
     """
     Loads a library, or installs it in ImportError case
@@ -347,10 +354,18 @@ def import_library(library_name: str, package_name: str = None):
     try:
         return importlib.import_module(library_name)
     except ImportError as exc:
-        completed = subprocess.run(
-            [sys.executable, "-m", "pip", "install", "--upgrade", package_name],
-            check=True,
-        )
+        # Modules are imported by several threads at startup, one pip at a time
+        with _pip_lock:
+            importlib.invalidate_caches()
+            try:
+                # Installed by another thread while this one waited
+                return importlib.import_module(library_name)
+            except ImportError:
+                pass
+            completed = subprocess.run(
+                [sys.executable, "-m", "pip", "install", "--upgrade", package_name],
+                check=True,
+            )
         if completed.returncode != 0:
             raise AssertionError(
                 f"Failed to install library {package_name} (pip exited with code {completed.returncode})"
@@ -426,6 +441,40 @@ def resize_new_image(image_path, output_path, desired_width=None, desired_height
         os.remove(image_path)
 
 
+def module_path(module_name: str, core=False) -> str:
+    return f"modules.{'custom_modules.' if not core else ''}{module_name}"
+
+
+def read_meta(path: str) -> Dict[str, str]:
+    with open(f"{path.replace('.', '/')}.py", encoding="utf-8") as f:
+        return parse_meta_comments(f.read())
+
+
+def module_handlers(module: ModuleType) -> List[Tuple[Handler, int]]:
+    """Get (handler, group) pairs of the decorated functions in module"""
+    handlers = []
+    for _name, obj in vars(module).items():
+        if isinstance(getattr(obj, "handlers", []), list):
+            handlers.extend(getattr(obj, "handlers", []))
+    return handlers
+
+
+# module name -> (handler, group) pairs as added to the router, with metrics
+registered_handlers: Dict[str, List[Tuple[Handler, int]]] = {}
+
+
+def register_module(module: ModuleType, module_name: str, client: Client, meta):
+    handlers = []
+    with profiler.phase("handler registration"):
+        for handler, group in module_handlers(module):
+            handler = instrument(handler, module_name, group)
+            router.add_handler(client, handler, group)
+            handlers.append((handler, group))
+    registered_handlers[module_name] = handlers
+
+    module.__meta__ = meta
+
+
 async def load_module(
     module_name: str,
     client: Client,
@@ -435,11 +484,8 @@ async def load_module(
     if module_name in modules_help and not core:
         await unload_module(module_name, client)
 
-    path = f"modules.{'custom_modules.' if not core else ''}{module_name}"
-
-    with open(f"{path.replace('.', '/')}.py", encoding="utf-8") as f:
-        code = f.read()
-    meta = parse_meta_comments(code)
+    path = module_path(module_name, core)
+    meta = read_meta(path)
 
     packages = meta.get("requires", "").split()
     requirements_list.extend(packages)
@@ -485,16 +531,162 @@ async def load_module(
 
         module = importlib.import_module(path)
 
-    for _name, obj in vars(module).items():
-        if isinstance(getattr(obj, "handlers", []), list):
-            for handler, group in getattr(obj, "handlers", []):
-                client.add_handler(handler, group)
-
-    module.__meta__ = meta
+    register_module(module, module_name, client, meta)
 
     return module
 
 
+# module name -> seconds its import took at startup
+import_times: Dict[str, float] = {}
+
+
+def _import_module(module_name: str, core: bool, meta: Dict[str, str] = None):
+    start = time.perf_counter()
+    path = module_path(module_name, core)
+    if meta is None:
+        meta = read_meta(path)
+    module = importlib.import_module(path)
+    return module, meta, time.perf_counter() - start
+
+
+async def load_modules(
+    client: Client,
+    modules: List[Tuple[str, bool]],
+    workers: int = 8,
+    metas: Dict[str, Dict[str, str]] = None,
+) -> Dict[str, BaseException]:
+    """
+    Load (module_name, core) pairs at startup, get errors by module name.
+
+    Meta comments are read (unless metas has them by import path) and
+    modules imported in worker threads, then handlers are registered in the
+    order of ``modules``, so dispatch order doesn't depend on which import
+    finished first. Modules that fail in a thread (missing requirements,
+    code that needs the event loop at import time) get a second try with
+    load_module on the loop.
+    """
+    metas = metas or {}
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(workers, thread_name_prefix="module-import") as pool:
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    pool,
+                    _import_module,
+                    module_name,
+                    core,
+                    metas.get(module_path(module_name, core)),
+                )
+                for module_name, core in modules
+            ),
+            return_exceptions=True,
+        )
+
+    errors = {}
+    for (module_name, core), result in zip(modules, results):
+        if isinstance(result, BaseException):
+            start = time.perf_counter()
+            try:
+                await load_module(module_name, client, core=core)
+            except Exception as e:
+                errors[module_name] = e
+            else:
+                import_times[module_name] = time.perf_counter() - start
+            continue
+
+        module, meta, elapsed = result
+        requirements_list.extend(meta.get("requires", "").split())
+        register_module(module, module_name, client, meta)
+        import_times[module_name] = elapsed
+
+    # Modules fill it as their imports finish, keep help pages stable
+    ordered = sorted(modules_help.items())
+    modules_help.clear()
+    modules_help.update(ordered)
+    return errors
+
+
+# module name -> command stubs [(handler, group)] of modules not imported yet
+lazy_modules: Dict[str, List[Tuple[Handler, int]]] = {}
+_lazy_locks: Dict[str, asyncio.Lock] = {}
+
+
+def register_lazy_module(module_name: str, client: Client, manifest: dict):
+    """
+    Register command stubs of a core module instead of importing it.
+
+    manifest comes from utils.manifest. The first command of the module
+    imports it, registers its handlers in place of the stubs and passes the
+    message on to them.
+    """
+    meta = manifest.get("meta")
+    if meta is not None:
+        # Known before the import, so the updater installs them too
+        requirements_list.extend(meta.get("requires", "").split())
+    modules_help.update(manifest["help"])
+    stubs = []
+    for group, commands in manifest["commands"].items():
+        handler = MessageHandler(
+            _lazy_stub(module_name, int(group), meta),
+            filters.command(commands, prefix),
+        )
+        router.add_handler(client, handler, int(group))
+        stubs.append((handler, int(group)))
+    lazy_modules[module_name] = stubs
+
+
+def _lazy_stub(module_name: str, group: int, meta: Dict[str, str] = None):
+    async def lazy_stub(client: Client, message: Message):
+        await import_lazy_module(module_name, client, meta)
+        await _dispatch(module_name, group, client, message)
+
+    return lazy_stub
+
+
+async def import_lazy_module(
+    module_name: str, client: Client, meta: Dict[str, str] = None
+) -> ModuleType:
+    async with _lazy_locks.setdefault(module_name, asyncio.Lock()):
+        if module_name not in lazy_modules:
+            # Another command got here first
+            return sys.modules[module_path(module_name, core=True)]
+
+        start = time.perf_counter()
+        try:
+            module, meta, _ = await asyncio.get_running_loop().run_in_executor(
+                None, _import_module, module_name, True, meta
+            )
+        except Exception:
+            # Same second try as at startup
+            module = await load_module(module_name, client, core=True)
+        else:
+            register_module(module, module_name, client, meta)
+
+        # Real handlers are in place before the stubs go, so the router never
+        # has a moment without a route for these commands
+        for handler, group in lazy_modules.pop(module_name):
+            router.remove_handler(client, handler, group)
+        import_times[module_name] = time.perf_counter() - start
+        return module
+
+
+async def _dispatch(module_name: str, group: int, client: Client, message: Message):
+    # What the dispatcher would have done with the module's handlers in group,
+    # the registered ones, so the call shows up in the metrics as usual
+    continued = False
+    for handler, handler_group in registered_handlers[module_name]:
+        if handler_group != group or not await handler.check(client, message):
+            continue
+        try:
+            await handler.callback(client, message)
+        except ContinuePropagation:
+            continued = True
+            continue
+        return
+    if continued:
+        raise ContinuePropagation
+
+
 async def unload_module(module_name: str, client: Client) -> bool:
     path = "modules.custom_modules." + module_name
     if path not in sys.modules:
@@ -504,10 +696,11 @@ async def unload_module(module_name: str, client: Client) -> bool:
 
     for _name, obj in vars(module).items():
         for handler, group in getattr(obj, "handlers", []):
-            client.remove_handler(handler, group)
+            router.remove_handler(client, handler, group)
 
     del modules_help[module_name]
     del sys.modules[path]
+    registered_handlers.pop(module_name, None)
 
     return True
 
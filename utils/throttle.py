@@ -0,0 +1,204 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+from pyrogram import Client, raw
+from pyrogram.errors import FloodPremiumWait, FloodWait
+from pyrogram.raw.core import TLObject
+from pyrogram.session import Session
+
+__all__ = ["LIMITS", "METHOD_CLASSES", "Bucket", "RequestScheduler", "scheduler"]
+
+# Method class -> (requests a second, burst), for each chat separately
+LIMITS: Dict[str, Tuple[float, int]] = {
+    "send": (1.0, 5),
+    "edit": (1.0, 5),
+    "delete": (3.0, 10),
+    "admin": (2.0, 10),
+    "read": (5.0, 20),
+}
+
+METHOD_CLASSES = {
+    raw.functions.messages.SendMessage: "send",
+    raw.functions.messages.SendMedia: "send",
+    raw.functions.messages.SendMultiMedia: "send",
+    raw.functions.messages.ForwardMessages: "send",
+    raw.functions.messages.SendReaction: "send",
+    raw.functions.messages.EditMessage: "edit",
+    raw.functions.messages.DeleteMessages: "delete",
+    raw.functions.channels.DeleteMessages: "delete",
+    raw.functions.channels.EditBanned: "admin",
+    raw.functions.channels.EditAdmin: "admin",
+    raw.functions.messages.DeleteChatUser: "admin",
+    raw.functions.messages.ReadMentions: "read",
+    raw.functions.messages.ReadReactions: "read",
+    raw.functions.messages.ReadHistory: "read",
+    raw.functions.channels.ReadHistory: "read",
+}
+
+
+class Bucket:
+    """
+    Token bucket of one method class in one chat.
+
+    After a FloodWait the bucket is paused for its duration and its rate is
+    halved, then the rate creeps back to the default with each success.
+    Buckets without a limit only get paused.
+    """
+
+    __slots__ = ("rate", "base_rate", "burst", "tokens", "updated", "paused", "lock")
+
+    def __init__(self, rate: Optional[float] = None, burst: int = 1):
+        self.rate = rate
+        self.base_rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused = 0.0
+        # asyncio.Lock wakes waiters in order, requests of a bucket keep theirs
+        self.lock = asyncio.Lock()
+
+    def idle(self) -> bool:
+        return (
+            not self.lock.locked()
+            and self.paused <= time.monotonic()
+            and self.rate == self.base_rate
+        )
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if self.paused > now:
+                    await asyncio.sleep(self.paused - now)
+                    continue
+                if self.rate is None:
+                    return
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def flood(self, seconds: float):
+        self.paused = max(self.paused, time.monotonic() + seconds)
+        if self.rate is not None:
+            self.rate = max(self.rate / 2, 1 / 60)
+            self.tokens = 0.0
+
+    def success(self):
+        if self.rate is not None and self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate / 20)
+
+
+def _peer_id(query: TLObject) -> Optional[Hashable]:
+    # TLObject truthiness serializes the object, compare with None instead
+    peer = getattr(query, "peer", None)
+    if peer is None:
+        peer = getattr(query, "channel", None)
+    if peer is None:
+        return None
+    for attr in ("channel_id", "chat_id", "user_id"):
+        value = getattr(peer, attr, None)
+        if value is not None:
+            return attr, value
+    # InputPeerSelf and such
+    return type(peer).__name__
+
+
+class RequestScheduler:
+    """
+    Wraps ``Client.invoke`` with FloodWait-aware token buckets.
+
+    Each request goes through the bucket of its method class and chat
+    (unlisted methods get an unlimited bucket per method). FloodWait up to
+    the client's sleep threshold pauses only that bucket and the request is
+    retried, everything else keeps going; longer ones are raised as before.
+    """
+
+    def __init__(self, max_buckets: int = 4096):
+        self.max_buckets = max_buckets
+        self.buckets: Dict[tuple, Bucket] = {}
+        self.floods = 0
+
+    def bucket(self, query: TLObject) -> Bucket:
+        method = METHOD_CLASSES.get(type(query), type(query).QUALNAME)
+        key = (method, _peer_id(query))
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_buckets:
+                self._forget_idle()
+            rate, burst = LIMITS.get(method, (None, 1))
+            bucket = self.buckets[key] = Bucket(rate, burst)
+        return bucket
+
+    def _forget_idle(self):
+        for key in [key for key, bucket in self.buckets.items() if bucket.idle()]:
+            del self.buckets[key]
+
+    def install(self, client: Client):
+        invoke = client.invoke
+
+        async def scheduled_invoke(
+            query: TLObject,
+            retries: int = Session.MAX_RETRIES,
+            timeout: float = Session.WAIT_TIMEOUT,
+            sleep_threshold: float = None,
+        ):
+            threshold = (
+                client.sleep_threshold if sleep_threshold is None else sleep_threshold
+            )
+            bucket = self.bucket(query)
+            while True:
+                await bucket.acquire()
+                try:
+                    # Threshold 0 makes the session raise every FloodWait
+                    result = await invoke(query, retries, timeout, 0)
+                except (FloodWait, FloodPremiumWait) as e:
+                    self.floods += 1
+                    bucket.flood(e.value)
+                    # Same rule as the session: a negative threshold always waits
+                    if threshold >= 0 and e.value > threshold:
+                        raise
+                    logging.info(
+                        "Waiting %ss before %s (FloodWait)",
+                        e.value,
+                        type(query).QUALNAME,
+                    )
+                    continue
+                bucket.success()
+                return result
+
+        client.invoke = scheduled_invoke
+
+    def paused(self) -> Dict[tuple, float]:
+        """Get buckets paused by FloodWait and seconds left"""
+        now = time.monotonic()
+        return {
+            key: bucket.paused - now
+            for key, bucket in self.buckets.items()
+            if bucket.paused > now
+        }
+
+
+scheduler = RequestScheduler()
@@ -0,0 +1,134 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import deque
+from typing import Any, Optional, Tuple
+
+__all__ = ["EXACT", "CONTAINS", "WORD", "MODES", "TriggerIndex"]
+
+# The whole message is the trigger
+EXACT = "exact"
+# The trigger is anywhere in the message
+CONTAINS = "contains"
+# The trigger is in the message and isn't a part of a longer word
+WORD = "word"
+
+MODES = (EXACT, CONTAINS, WORD)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class TriggerIndex:
+    """
+    Finds which of many triggers a message matches.
+
+    Exact triggers are a dict lookup. Substring and word triggers share one
+    Aho-Corasick automaton, so a message is matched in time linear in its
+    length however many triggers there are. The automaton is rebuilt lazily
+    on the first match after triggers change.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._patterns = {}
+        self._automaton = None
+
+    def __len__(self):
+        return len(self._exact) + len(self._patterns)
+
+    def __contains__(self, trigger: str):
+        return trigger in self._exact or trigger in self._patterns
+
+    def add(self, trigger: str, value: Any = None, mode: str = EXACT):
+        """Add trigger (or replace the one with the same text)"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown trigger mode: {mode}")
+        self.remove(trigger)
+        if mode == EXACT or not trigger:
+            self._exact[trigger] = value
+        else:
+            self._patterns[trigger] = (mode, value)
+            self._automaton = None
+
+    def remove(self, trigger: str):
+        self._exact.pop(trigger, None)
+        if self._patterns.pop(trigger, None) is not None:
+            self._automaton = None
+
+    def match(self, text: str) -> Optional[Tuple[str, Any]]:
+        """
+        Get ``(trigger, value)`` of the trigger matching text, or None.
+
+        Exact triggers win, then the match that ends first in the text,
+        and the longest of the triggers ending at the same place.
+        """
+        if text in self._exact:
+            return text, self._exact[text]
+        if not self._patterns:
+            return None
+        if self._automaton is None:
+            self._automaton = self._build()
+
+        goto, fail, output = self._automaton
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for trigger in output[state]:
+                mode, value = self._patterns[trigger]
+                if mode == WORD and not self._is_word(text, end - len(trigger), end):
+                    continue
+                return trigger, value
+        return None
+
+    @staticmethod
+    def _is_word(text: str, start: int, end: int) -> bool:
+        return (start == 0 or not _is_word_char(text[start - 1])) and (
+            end == len(text) or not _is_word_char(text[end])
+        )
+
+    def _build(self):
+        # goto[state] maps a character to the next state, output[state] lists
+        # triggers ending in that state longest first, including the ones
+        # reachable through failure links
+        goto = [{}]
+        output = [[]]
+        for trigger in self._patterns:
+            state = 0
+            for char in trigger:
+                if char not in goto[state]:
+                    goto.append({})
+                    output.append([])
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            output[state].append(trigger)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in goto[state].items():
+                queue.append(child)
+                link = fail[state]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                fail[child] = goto[link].get(char, 0)
+                # fail[child] is nearer to the root, so its output is complete
+                output[child] = output[child] + output[fail[child]]
+        return goto, fail, output
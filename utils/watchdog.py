@@ -0,0 +1,169 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, List, Optional
+
+__all__ = ["Stall", "LoopWatchdog", "watchdog"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = os.path.join(ROOT, "modules") + os.sep
+
+
+def owner(stack: traceback.StackSummary) -> str:
+    """Name the userbot module (or file) the blocking code belongs to"""
+    for frame in reversed(stack):
+        if frame.filename.startswith(MODULES):
+            return os.path.splitext(os.path.basename(frame.filename))[0]
+    for frame in reversed(stack):
+        if frame.filename.startswith(ROOT + os.sep):
+            return os.path.relpath(frame.filename, ROOT)
+    return "unknown"
+
+
+class Stall:
+    """The loop not getting back to the watchdog for longer than threshold"""
+
+    __slots__ = ("started", "duration", "module", "stack")
+
+    def __init__(self, started: float, module: str, stack: traceback.StackSummary):
+        self.started = started
+        # Updated until the loop is back
+        self.duration = 0.0
+        self.module = module
+        self.stack = stack
+
+    def format_stack(self, limit: int = 6) -> str:
+        return "".join(traceback.format_list(self.stack[-limit:]))
+
+
+class LoopWatchdog:
+    """
+    Measures event loop lag and catches code that blocks the loop.
+
+    A task on the loop wakes up every ``interval`` seconds and records how
+    late it was. A thread checks that task's heartbeat; when the loop hasn't
+    come back for ``threshold`` seconds it takes the stack of the loop
+    thread, so the report shows the blocking call and the module it's from.
+    """
+
+    def __init__(
+        self, interval: float = 0.1, threshold: float = 0.5, history: int = 50
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        # Lag samples of the last minute or so
+        self.lags = deque(maxlen=int(60 / interval))
+        self.stalls = deque(maxlen=history)
+        # module -> [stalls, blocked seconds, longest stall]
+        self.modules: Dict[str, List] = {}
+
+        self._heartbeat = time.monotonic()
+        self._stall: Optional[Stall] = None
+        self._lock = threading.Lock()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start watching the running loop"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        self._stopped.set()
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            self.lags.append(lag)
+            with self._lock:
+                self._heartbeat = now
+                stall, self._stall = self._stall, None
+            if stall is not None:
+                self._finish(stall, lag)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                blocked = time.monotonic() - self._heartbeat - self.interval
+                if blocked < self.threshold or self._stall is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is None:
+                    continue
+                stack = traceback.extract_stack(frame)
+                stall = Stall(time.time() - blocked, owner(stack), stack)
+                self._stall = stall
+            # _beat() may take self._stall as soon as the lock is released
+            logging.warning(
+                "Event loop blocked for %.2fs in %s:\n%s",
+                blocked,
+                stall.module,
+                stall.format_stack(),
+            )
+
+    def _finish(self, stall: Stall, lag: float):
+        stall.duration = lag
+        self.stalls.append(stall)
+        record = self.modules.setdefault(stall.module, [0, 0.0, 0.0])
+        record[0] += 1
+        record[1] += lag
+        record[2] = max(record[2], lag)
+        logging.warning("Event loop was blocked for %.2fs by %s", lag, stall.module)
+
+    def lag(self) -> dict:
+        """Get lag of the last minute, in seconds"""
+        samples = sorted(self.lags)
+        if not samples:
+            return {"current": 0.0, "avg": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "current": self.lags[-1],
+            "avg": sum(samples) / len(samples),
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "max": samples[-1],
+        }
+
+    def reset(self):
+        self.lags.clear()
+        self.stalls.clear()
+        self.modules.clear()
+
+
+watchdog = LoopWatchdog()
@@ -0,0 +1,246 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from pyrogram import ContinuePropagation, StopPropagation
+
+__all__ = [
+    "OWNER",
+    "PASSIVE",
+    "DROP_NEW",
+    "DROP_OLD",
+    "MERGE",
+    "WorkQueue",
+    "queued",
+    "queues",
+]
+
+# Priorities, lower runs first. Owner jobs also skip the concurrency limits
+OWNER = 0
+PASSIVE = 10
+
+# What to do with a job submitted to a full chat queue
+DROP_NEW = "drop_new"  # reject the new job
+DROP_OLD = "drop_old"  # forget the oldest pending job of the chat
+MERGE = "merge"  # replace the pending job with the same key, else drop new
+
+POLICIES = (DROP_NEW, DROP_OLD, MERGE)
+
+# name -> queue, for .stats
+queues: Dict[str, "WorkQueue"] = {}
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat", "key", "func", "args", "dropped")
+
+    def __init__(self, priority, seq, chat, key, func, args):
+        self.priority = priority
+        self.seq = seq
+        self.chat = chat
+        self.key = key
+        self.func = func
+        self.args = args
+        self.dropped = False
+
+    def __lt__(self, other: "_Job"):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class WorkQueue:
+    """
+    Runs background jobs of passive handlers with bounded concurrency.
+
+    At most ``concurrency`` jobs run at once, and at most ``per_chat`` of
+    them for the same chat, so a burst in one chat can't take every slot
+    (or reorder the replies of a chat with ``per_chat=1``). Each chat keeps
+    up to ``max_pending`` waiting jobs, what happens to the rest is decided
+    by ``policy``. Waiting jobs start by priority, then in submit order.
+
+    ``submit`` never blocks: the handler returns right away and the
+    dispatcher worker is free for the next update, owner commands included.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int = 4,
+        per_chat: int = 1,
+        max_pending: int = 10,
+        policy: str = DROP_NEW,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.name = name
+        self.concurrency = concurrency
+        self.per_chat = per_chat
+        self.max_pending = max_pending
+        self.policy = policy
+
+        self._heap = []
+        self._pending: Dict[Hashable, deque] = {}
+        self._running: Dict[Hashable, int] = {}
+        self._active = 0
+        self._seq = itertools.count()
+        self._tasks = set()
+
+        self.submitted = 0
+        self.dropped = 0
+        self.merged = 0
+        self.failed = 0
+        queues[name] = self
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def submit(
+        self,
+        chat: Hashable,
+        func: Callable,
+        *args: Any,
+        priority: int = PASSIVE,
+        key: Optional[Hashable] = None,
+    ) -> bool:
+        """
+        Queue ``func(*args)`` for chat.
+
+        Returns False if the job was dropped because the chat queue is full.
+        """
+        self.submitted += 1
+        pending = self._pending.setdefault(chat, deque())
+
+        if self.policy == MERGE and key is not None:
+            for job in pending:
+                if job.key == key:
+                    job.func, job.args = func, args
+                    self.merged += 1
+                    return True
+
+        if len(pending) >= self.max_pending:
+            if self.policy != DROP_OLD:
+                self.dropped += 1
+                return False
+            pending.popleft().dropped = True
+            self.dropped += 1
+
+        job = _Job(priority, next(self._seq), chat, key, func, args)
+        pending.append(job)
+        heapq.heappush(self._heap, job)
+        self._pump()
+        return True
+
+    def _can_start(self, job: _Job) -> bool:
+        if job.priority <= OWNER:
+            return True
+        return (
+            self._active < self.concurrency
+            and self._running.get(job.chat, 0) < self.per_chat
+        )
+
+    def _pump(self):
+        # Jobs of busy chats are set aside and put back after the scan
+        waiting = []
+        while self._heap:
+            job = heapq.heappop(self._heap)
+            if job.dropped:
+                continue
+            if not self._can_start(job):
+                waiting.append(job)
+                if job.priority > OWNER and self._active >= self.concurrency:
+                    break
+                continue
+            self._start(job)
+        for job in waiting:
+            heapq.heappush(self._heap, job)
+
+    def _start(self, job: _Job):
+        pending = self._pending[job.chat]
+        pending.remove(job)
+        if not pending:
+            del self._pending[job.chat]
+        self._running[job.chat] = self._running.get(job.chat, 0) + 1
+        self._active += 1
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: _Job):
+        try:
+            await job.func(*job.args)
+        except (ContinuePropagation, StopPropagation):
+            # The dispatcher moved on long ago, nothing to propagate to
+            pass
+        except Exception:
+            self.failed += 1
+            logging.exception("Job of %s queue failed", self.name)
+        finally:
+            self._active -= 1
+            self._running[job.chat] -= 1
+            if not self._running[job.chat]:
+                del self._running[job.chat]
+            self._pump()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._active,
+            "pending": len(self),
+            "chats": len(self._pending),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "merged": self.merged,
+            "failed": self.failed,
+        }
+
+
+def _chat_id(update) -> Hashable:
+    return update.chat.id if update.chat else None
+
+
+def queued(
+    queue: WorkQueue,
+    chat: Callable[[Any], Hashable] = _chat_id,
+    key: Optional[Callable[[Any], Hashable]] = None,
+    priority: int = PASSIVE,
+):
+    """
+    Run a handler callback through queue instead of the dispatcher.
+
+    Goes under ``@Client.on_message(...)``. ``chat`` and ``key`` get the
+    update and pick its chat and merge key. The callback can't stop or
+    continue propagation, it runs after the dispatcher moved on.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(client, update):
+            queue.submit(
+                chat(update),
+                func,
+                client,
+                update,
+                priority=priority,
+                key=key(update) if key else None,
+            )
+
+        return wrapper
+
+    return decorator